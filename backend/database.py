@@ -4,129 +4,138 @@ Loads reclamatii.csv into DuckDB with proper schema
 """
 
 import os
+import hashlib
+import queue
+import threading
+import time
 import duckdb
-import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from contextlib import contextmanager
+from datetime import timedelta
 from pathlib import Path
 
 # Database file path
 DB_PATH = Path(__file__).parent.parent / "reclamatii.duckdb"
 CSV_PATH = Path(__file__).parent.parent / "reclamatii.csv"
+PARQUET_PATH = Path(__file__).parent.parent / "reclamatii.parquet"
 
-# Global connection
-_connection = None
+# Shared read-only connection behind the query pool. The read-write connection
+# only exists while init_database is loading.
+_read_connection = None
 
+# Pool of per-thread handles for request-time queries (a single handle must
+# not be used from several threads at once)
+POOL_SIZE = int(os.getenv("DUCKDB_POOL_SIZE") or os.cpu_count() or 1)
+_pool: queue.Queue | None = None
+_pool_lock = threading.Lock()
 
-def get_connection() -> duckdb.DuckDBPyConnection:
-    """Get or create DuckDB connection."""
-    global _connection
-    if _connection is None:
-        _connection = duckdb.connect(str(DB_PATH))
-    return _connection
+# Profile request queries and log the plan of any slower than this many ms (off when unset)
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS") or 0)
 
+# Fixed request-time queries, PREPAREd once on every pooled connection so
+# requests skip parsing/binding (run with "EXECUTE <name>")
+_SAMPLE_SQL = """
+    SELECT nr_reclamatie, data_reclamatie, raion, motiv_reclamatie, valoare
+    FROM complaints
+    LIMIT 5
+"""
+_PREPARED_STATEMENTS = {
+    "sample_rows": _SAMPLE_SQL,
+    # Same rows, serialized to the /api/sample response body by DuckDB
+    "sample_rows_json": f"""
+        SELECT to_json({{'data': COALESCE(list(t), [])}})
+        FROM ({_SAMPLE_SQL}) t
+    """,
+}
 
-def init_database() -> bool:
-    """Initialize database from CSV if needed."""
-    con = get_connection()
-    
-    # Check if table exists
-    tables = con.execute("SHOW TABLES").fetchall()
-    if any("complaints" in str(t) for t in tables):
-        count = con.execute("SELECT COUNT(*) FROM complaints").fetchone()[0]
-        print(f"✅ Database ready: {count:,} complaints")
-        return True
-    
-    # Load from CSV
-    if not CSV_PATH.exists():
-        print(f"❌ CSV not found: {CSV_PATH}")
-        return False
-    
-    print("📂 Loading CSV into DuckDB...")
-    df = pd.read_csv(CSV_PATH, encoding="utf-8")
-    
-    # Clean date columns
-    date_cols = ["DATA RECLAMATIE", "DATA FACTURA", "DATA COMANDA"]
-    for col in date_cols:
-        if col in df.columns:
-            df[col] = pd.to_datetime(df[col], format="%d.%m.%Y", errors="coerce")
-    
-    # Clean numeric columns
-    if "Valoare Articole Reclamate" in df.columns:
-        df["Valoare Articole Reclamate"] = pd.to_numeric(
-            df["Valoare Articole Reclamate"], errors="coerce"
-        ).fillna(0.0)
-    
-    if "Cantitate Reclamata" in df.columns:
-        df["Cantitate Reclamata"] = pd.to_numeric(
-            df["Cantitate Reclamata"], errors="coerce"
-        ).fillna(0).astype(int)
-    
-    # Clean string columns
-    text_cols = df.select_dtypes(include=["object"]).columns
-    for col in text_cols:
-        df[col] = df[col].fillna("").astype(str).replace("#null", "")
-    
-    # Rename columns to clean SQL names
-    column_mapping = {
-        "NR RECLAMATIE": "nr_reclamatie",
-        "RAION": "raion",
-        "PM": "pm",
-        "OBSERVATII": "observatii",
-        "NUME CLIENT": "nume_client",
-        "NR COMANDA": "nr_comanda",
-        "ID COMANDA": "id_comanda",
-        "GRUPA MEDIU VANZARE": "grup_vanzare",
-        "FURNIZOR": "furnizor",
-        "ECHIPA LIVRARE COMANDA": "echipa_livrare",
-        "DATA FACTURA": "data_factura",
-        "DATA COMANDA": "data_comanda",
-        "DATA RECLAMATIE": "data_reclamatie",
-        "MAGAZIN": "magazin",
-        "ARTICOL COD": "articol_cod",
-        "ID CLIENT": "id_client",
-        "ARTICOL DENUMIRE": "articol_denumire",
-        "MODALITATE REZOLVARE": "modalitate_rezolvare",
-        "MOTIV RECLAMATIE": "motiv_reclamatie",
-        "DESCRIERE": "descriere",
-        "MOD LIVRARE": "mod_livrare",
-        "FURNIZOR EXT": "furnizor_ext",
-        "RESPONSABIL COMANDA": "responsabil_comanda",
-        "Cantitate Reclamata": "cantitate",
-        "Valoare Articole Reclamate": "valoare"
-    }
-    df = df.rename(columns=column_mapping)
-    
-    # Create table
-    con.execute("DROP TABLE IF EXISTS complaints")
-    con.execute("CREATE TABLE complaints AS SELECT * FROM df")
-    
-    count = con.execute("SELECT COUNT(*) FROM complaints").fetchone()[0]
-    print(f"✅ Loaded {count:,} complaints into DuckDB")
-    
-    return True
+# Dashboard stats; the data only changes when init_database rebuilds the table
+_stats_cache: dict | None = None
 
+# Connection settings for the analytical workload. Memory limit and spill
+# directory are opt-in via env so small hosts (Render free tier) can cap them.
+DUCKDB_CONFIG = {
+    "threads": int(os.getenv("DUCKDB_THREADS") or os.cpu_count() or 1),
+    "preserve_insertion_order": False,  # lets scans/aggregations skip order bookkeeping
+    "enable_object_cache": True,
+}
+if os.getenv("DUCKDB_MEMORY_LIMIT"):
+    DUCKDB_CONFIG["memory_limit"] = os.getenv("DUCKDB_MEMORY_LIMIT")
+if os.getenv("DUCKDB_TEMP_DIR"):
+    DUCKDB_CONFIG["temp_directory"] = os.getenv("DUCKDB_TEMP_DIR")
 
-def execute_query(sql: str) -> tuple[list[dict], list[str], str | None]:
-    """
-    Execute SQL query and return results.
-    Returns: (rows as list of dicts, column names, error message or None)
-    """
-    con = get_connection()
-    try:
-        result = con.execute(sql)
-        columns = [desc[0] for desc in result.description]
-        rows = result.fetchall()
-        
-        # Convert to list of dicts
-        data = [dict(zip(columns, row)) for row in rows]
-        
-        return data, columns, None
-    except Exception as e:
-        return [], [], str(e)
+# Explicit CSV header, so the reader skips dialect/type sniffing. Every column
+# is read as text and typed in the projection, where TRY_* turns malformed
+# values into NULL instead of failing the load. "#null", "" and "NA" are NULL.
+CSV_COLUMNS = dict.fromkeys((
+    "NR RECLAMATIE",
+    "RAION",
+    "PM",
+    "OBSERVATII",
+    "NUME CLIENT",
+    "NR COMANDA",
+    "ID COMANDA",
+    "GRUPA MEDIU VANZARE",
+    "FURNIZOR",
+    "ECHIPA LIVRARE COMANDA",
+    "DATA FACTURA",
+    "DATA COMANDA",
+    "DATA RECLAMATIE",
+    "MAGAZIN",
+    "ARTICOL COD",
+    "ID CLIENT",
+    "ARTICOL DENUMIRE",
+    "MODALITATE REZOLVARE",
+    "MOTIV RECLAMATIE",
+    "DESCRIERE",
+    "MOD LIVRARE",
+    "FURNIZOR EXT",
+    "RESPONSABIL COMANDA",
+    "Cantitate Reclamata",
+    "Valoare Articole Reclamate",
+), "VARCHAR")
 
+# CSV header -> clean SQL column, with the cast applied while loading.
+# Dates are DD.MM.YYYY; unparseable values become NULL, empty numerics become 0.
+_DATE_FORMAT = "%d.%m.%Y"
+COMPLAINTS_PROJECTION = f"""
+    TRY_CAST("NR RECLAMATIE" AS BIGINT) AS nr_reclamatie,
+    COALESCE("RAION", '') AS raion,
+    COALESCE("PM", '') AS pm,
+    COALESCE("OBSERVATII", '') AS observatii,
+    COALESCE("NUME CLIENT", '') AS nume_client,
+    TRY_CAST("NR COMANDA" AS BIGINT) AS nr_comanda,
+    COALESCE("ID COMANDA", '') AS id_comanda,
+    COALESCE("GRUPA MEDIU VANZARE", '') AS grup_vanzare,
+    COALESCE("FURNIZOR", '') AS furnizor,
+    COALESCE("ECHIPA LIVRARE COMANDA", '') AS echipa_livrare,
+    TRY_STRPTIME("DATA FACTURA", '{_DATE_FORMAT}')::DATE AS data_factura,
+    TRY_STRPTIME("DATA COMANDA", '{_DATE_FORMAT}')::DATE AS data_comanda,
+    TRY_STRPTIME("DATA RECLAMATIE", '{_DATE_FORMAT}')::DATE AS data_reclamatie,
+    COALESCE("MAGAZIN", '') AS magazin,
+    COALESCE("ARTICOL COD", '') AS articol_cod,
+    TRY_CAST("ID CLIENT" AS BIGINT) AS id_client,
+    COALESCE("ARTICOL DENUMIRE", '') AS articol_denumire,
+    COALESCE("MODALITATE REZOLVARE", '') AS modalitate_rezolvare,
+    COALESCE("MOTIV RECLAMATIE", '') AS motiv_reclamatie,
+    COALESCE("DESCRIERE", '') AS descriere,
+    COALESCE("MOD LIVRARE", '') AS mod_livrare,
+    COALESCE("FURNIZOR EXT", '') AS furnizor_ext,
+    COALESCE("RESPONSABIL COMANDA", '') AS responsabil_comanda,
+    -- Fractional quantities are truncated (0.6 -> 0), not rounded by an INTEGER cast
+    COALESCE(TRUNC(TRY_CAST("Cantitate Reclamata" AS DOUBLE)), 0)::INTEGER AS cantitate,
+    COALESCE(TRY_CAST("Valoare Articole Reclamate" AS DOUBLE), 0.0) AS valoare
+"""
 
-def get_schema() -> str:
-    """Get table schema description for LLM context."""
-    return """
+# Hash of the load recipe, part of the version tag: a table or snapshot built
+# with a different projection or CSV schema is rebuilt even if the CSV is unchanged
+_LOAD_HASH = hashlib.blake2b(
+    f"{CSV_COLUMNS}\n{COMPLAINTS_PROJECTION}".encode(), digest_size=8
+).hexdigest()
+
+
+# Table schema description for LLM context
+SCHEMA = """
 TABLE: complaints (reclamații clienți Mobexpert)
 
 COLUMNS:
@@ -164,57 +173,301 @@ NOTES:
 """
 
 
-def get_sample_data() -> list[dict]:
-    """Get sample data for testing."""
-    con = get_connection()
-    result = con.execute("""
-        SELECT nr_reclamatie, data_reclamatie, raion, motiv_reclamatie, valoare
-        FROM complaints
-        LIMIT 5
-    """)
-    columns = [desc[0] for desc in result.description]
-    rows = result.fetchall()
-    return [dict(zip(columns, row)) for row in rows]
+def get_write_connection() -> duckdb.DuckDBPyConnection:
+    """Open a read-write DuckDB connection (only init_database writes)."""
+    return duckdb.connect(str(DB_PATH), config=DUCKDB_CONFIG)
 
 
-def get_stats() -> dict:
-    """Get basic statistics for dashboard."""
-    con = get_connection()
+def get_read_connection() -> duckdb.DuckDBPyConnection:
+    """Get or create the shared read-only DuckDB connection."""
+    global _read_connection
+    if _read_connection is None:
+        _read_connection = duckdb.connect(str(DB_PATH), read_only=True, config=DUCKDB_CONFIG)
+    return _read_connection
+
+
+def _close_read_connections() -> None:
+    """Close the query pool and the read-only connection (before a write)."""
+    global _pool, _read_connection
+    with _pool_lock:
+        if _pool is not None:
+            while not _pool.empty():
+                _pool.get_nowait().close()
+            _pool = None
+        if _read_connection is not None:
+            _read_connection.close()
+            _read_connection = None
+
+
+def _get_pool() -> queue.Queue:
+    """Get or create the pool of query connections."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            con = get_read_connection()
+            pool = queue.Queue(maxsize=POOL_SIZE)
+            for _ in range(POOL_SIZE):
+                # cursor() opens a new connection to the same database instance
+                cursor = con.cursor()
+                if SLOW_QUERY_MS:
+                    cursor.execute("SET enable_profiling = 'no_output'")
+                for name, sql in _PREPARED_STATEMENTS.items():
+                    cursor.execute(f"PREPARE {name} AS {sql}")
+                pool.put(cursor)
+            _pool = pool
+    return _pool
+
+
+@contextmanager
+def pooled_connection():
+    """Borrow a connection from the pool for the duration of the block."""
+    pool = _get_pool()
+    con = pool.get()
+    try:
+        yield con
+    finally:
+        pool.put(con)
+
+
+def _csv_version() -> str:
+    """Version tag of the table built from the CSV (its mtime + the load hash), or '' if it is missing."""
+    if not CSV_PATH.exists():
+        return ""
+    return f"{CSV_PATH.stat().st_mtime_ns}-{_LOAD_HASH}"
+
+
+def _parquet_version() -> str:
+    """Version tag the Parquet snapshot was written with, or '' if there is none."""
+    if not PARQUET_PATH.exists():
+        return ""
+    with duckdb.connect() as con:
+        row = con.execute(
+            "SELECT decode(value) FROM parquet_kv_metadata(?) WHERE decode(key) = 'version'",
+            [str(PARQUET_PATH)]
+        ).fetchone()
+    return row[0] if row else ""
+
+
+def init_database() -> bool:
+    """Initialize database from CSV if needed."""
+    # DuckDB won't open the file read-write while a read-only handle is alive
+    _close_read_connections()
+    con = get_write_connection()
+    try:
+        ready = _load_complaints(con)
+    finally:
+        con.close()
     
-    stats = {}
+    if ready:
+        refresh_stats()
+    return ready
+
+
+def _load_complaints(con: duckdb.DuckDBPyConnection) -> bool:
+    """Build the complaints table on a write connection unless it is current."""
+    csv_version = _csv_version()
     
-    # Total complaints
-    stats["total"] = con.execute("SELECT COUNT(*) FROM complaints").fetchone()[0]
+    # Fast path: one catalog lookup. The table comment holds the version it was built from.
+    table = con.execute("""
+        SELECT comment, estimated_size FROM duckdb_tables()
+        WHERE table_name = 'complaints'
+    """).fetchone()
+    if table and (not csv_version or table[0] == csv_version):
+        print(f"✅ Database ready: {table[1]:,} complaints")
+        return True
     
-    # Total value
-    stats["total_value"] = con.execute("SELECT SUM(valoare) FROM complaints").fetchone()[0]
+    # Prefer the Parquet snapshot (columnar, already typed) if it was written
+    # from the same CSV version; a newer file mtime alone proves nothing
+    parquet_fresh = PARQUET_PATH.exists() and (
+        not csv_version or _parquet_version() == csv_version
+    )
+    if parquet_fresh:
+        print("📂 Loading Parquet snapshot into DuckDB...")
+        con.execute("DROP TABLE IF EXISTS complaints")
+        con.execute(
+            "CREATE TABLE complaints AS SELECT * FROM read_parquet(?) ORDER BY data_reclamatie",
+            [str(PARQUET_PATH)]
+        )
+    else:
+        # Load from CSV
+        if not CSV_PATH.exists():
+            print(f"❌ CSV not found: {CSV_PATH}")
+            return False
+        
+        print("📂 Loading CSV into DuckDB...")
+        
+        # Parse, clean and rename in one pass inside DuckDB's native CSV reader
+        con.execute("DROP TABLE IF EXISTS complaints")
+        con.execute(f"""
+            CREATE TABLE complaints AS
+            SELECT {COMPLAINTS_PROJECTION}
+            FROM read_csv(?, header=true, columns=?, auto_detect=false,
+                          delim=',', quote='"', escape='"',
+                          nullstr=['#null', '', 'NA'])
+            ORDER BY data_reclamatie
+        """, [str(CSV_PATH), CSV_COLUMNS])
+        
+        # Snapshot to Parquet so the next rebuild skips CSV parsing; the
+        # version travels in the file's key-value metadata
+        con.execute(f"""
+            COPY complaints TO ? (FORMAT PARQUET, COMPRESSION ZSTD, ROW_GROUP_SIZE 122880,
+                                  KV_METADATA {{version: '{csv_version}'}})
+        """, [str(PARQUET_PATH)])
     
-    # Date range
-    date_range = con.execute("""
-        SELECT MIN(data_reclamatie), MAX(data_reclamatie) FROM complaints
-    """).fetchone()
-    stats["date_min"] = str(date_range[0]) if date_range[0] else None
-    stats["date_max"] = str(date_range[1]) if date_range[1] else None
+    # Rows are stored sorted by date, so zonemaps prune date-range filters;
+    # the ART index turns "reclamația 72335" lookups into point probes
+    con.execute("CREATE INDEX idx_complaints_nr ON complaints(nr_reclamatie)")
+    con.execute(f"COMMENT ON TABLE complaints IS '{csv_version}'")
     
-    # Top categories
-    top_raion = con.execute("""
-        SELECT raion, COUNT(*) as cnt
-        FROM complaints
-        GROUP BY raion
-        ORDER BY cnt DESC
-        LIMIT 5
-    """).fetchall()
-    stats["top_categories"] = [{"name": r[0], "count": r[1]} for r in top_raion]
+    count = con.execute("SELECT COUNT(*) FROM complaints").fetchone()[0]
+    print(f"✅ Loaded {count:,} complaints into DuckDB")
     
-    # Top reasons
-    top_reasons = con.execute("""
-        SELECT motiv_reclamatie, COUNT(*) as cnt
-        FROM complaints
-        WHERE motiv_reclamatie != ''
-        GROUP BY motiv_reclamatie
-        ORDER BY cnt DESC
-        LIMIT 5
-    """).fetchall()
-    stats["top_reasons"] = [{"name": r[0], "count": r[1]} for r in top_reasons]
+    return True
+
+
+def execute_query(sql: str) -> tuple[list[dict], list[str], str | None]:
+    """
+    Execute SQL query and return results.
+    Returns: (rows as list of dicts, column names, error message or None)
+    """
+    try:
+        with pooled_connection() as con:
+            started = time.perf_counter()
+            # Columnar fetch; Arrow builds the row dicts in C++
+            table = con.execute(sql).to_arrow_table()
+            if SLOW_QUERY_MS:
+                _log_if_slow(con, started)
+        
+        return _arrow_to_rows(table), table.column_names, None
+    except Exception as e:
+        return [], [], str(e)
+
+
+def _log_if_slow(con: duckdb.DuckDBPyConnection, started: float) -> None:
+    """Print the profiled plan of the last query if it exceeded SLOW_QUERY_MS."""
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if elapsed_ms >= SLOW_QUERY_MS:
+        plan = con.get_profiling_information(format="query_tree")
+        print(f"🐢 Slow query ({elapsed_ms:.0f} ms):\n{plan}")
+
+
+def _arrow_to_rows(table: pa.Table) -> list[dict]:
+    """Convert an Arrow result to JSON-ready row dicts."""
+    per_value = {}  # columns Arrow can't convert column-wide: name -> converter
+    for i, field in enumerate(table.schema):
+        column = table.column(i)
+        # HUGEINT (e.g. SUM over integers) is exported as decimal(38, 0)
+        if pa.types.is_decimal(field.type) and field.type.scale == 0:
+            try:
+                column = column.cast(pa.int64())
+            except pa.ArrowInvalid:
+                # Beyond int64: Python ints from the Decimal values, like fetchall()
+                per_value[field.name] = int
+                continue
+        # INTERVAL arrives as (months, days, ns); DuckDB's own conversion is a
+        # timedelta with 30-day months
+        elif pa.types.is_interval(field.type):
+            per_value[field.name] = _interval_to_timedelta
+            continue
+        # Dates/timestamps become strings once, column-wide, instead of
+        # per-value date objects the JSON encoder has to format row by row
+        elif pa.types.is_date(field.type):
+            column = column.cast(pa.string())
+        elif pa.types.is_timestamp(field.type) and field.type.tz is None:
+            # Same text as datetime.isoformat(): 'T' separator, microseconds only when non-zero
+            column = pc.strftime(column.cast(pa.timestamp("us"), safe=False), format="%Y-%m-%dT%H:%M:%S")
+            column = pc.replace_substring_regex(column, pattern=r"\.000000$", replacement="")
+        else:
+            continue
+        table = table.set_column(i, field.name, column)
     
-    return stats
+    rows = table.to_pylist()
+    for name, convert in per_value.items():
+        for row in rows:
+            if row[name] is not None:
+                row[name] = convert(row[name])
+    return rows
+
+
+def _interval_to_timedelta(value) -> timedelta:
+    """Arrow MonthDayNano -> timedelta, as DuckDB's fetchall() converts INTERVAL."""
+    return timedelta(days=value.months * 30 + value.days, microseconds=value.nanoseconds // 1000)
+
+
+def get_schema() -> str:
+    """Get table schema description for LLM context."""
+    return SCHEMA
+
+
+def get_sample_data() -> list[dict]:
+    """Get sample data for testing."""
+    with pooled_connection() as con:
+        table = con.execute("EXECUTE sample_rows").to_arrow_table()
+    return _arrow_to_rows(table)
+
+
+def get_sample_json() -> str:
+    """Get the sample rows as a ready-to-send JSON body ({"data": [...]})."""
+    with pooled_connection() as con:
+        return con.execute("EXECUTE sample_rows_json").fetchone()[0]
+
+
+def get_stats() -> dict:
+    """Get basic statistics for dashboard (computed once per load)."""
+    if _stats_cache is None:
+        return refresh_stats()
+    return _stats_cache
+
+
+def refresh_stats() -> dict:
+    """Recompute the dashboard statistics and replace the cached copy."""
+    global _stats_cache
+    _stats_cache = _compute_stats()
+    return _stats_cache
+
+
+def _compute_stats() -> dict:
+    """Run the dashboard aggregates against the complaints table."""
+    # One round-trip: every section is a CTE over the same scan of complaints
+    with pooled_connection() as con:
+        row = con.execute("""
+            WITH totals AS (
+                SELECT COUNT(*) AS total,
+                       SUM(valoare) AS total_value,
+                       MIN(data_reclamatie) AS date_min,
+                       MAX(data_reclamatie) AS date_max
+                FROM complaints
+            ),
+            top_raion AS (
+                SELECT list({'name': raion, 'count': cnt} ORDER BY cnt DESC) AS top_categories
+                FROM (
+                    SELECT raion, COUNT(*) AS cnt
+                    FROM complaints
+                    GROUP BY raion
+                    ORDER BY cnt DESC
+                    LIMIT 5
+                )
+            ),
+            top_motiv AS (
+                SELECT list({'name': motiv_reclamatie, 'count': cnt} ORDER BY cnt DESC) AS top_reasons
+                FROM (
+                    SELECT motiv_reclamatie, COUNT(*) AS cnt
+                    FROM complaints
+                    WHERE motiv_reclamatie != ''
+                    GROUP BY motiv_reclamatie
+                    ORDER BY cnt DESC
+                    LIMIT 5
+                )
+            )
+            SELECT * FROM totals, top_raion, top_motiv
+        """).fetchone()
+    
+    total, total_value, date_min, date_max, top_categories, top_reasons = row
+    return {
+        "total": total,
+        "total_value": total_value,
+        "date_min": str(date_min) if date_min else None,
+        "date_max": str(date_max) if date_max else None,
+        "top_categories": top_categories or [],
+        "top_reasons": top_reasons or [],
+    }
@@ -4,13 +4,16 @@ Exposes endpoints for chat, schema, and statistics
 """
 
 import os
+import orjson
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException
+from typing import Any
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
-from database import init_database, get_schema, get_stats, get_sample_data
+from database import init_database, get_schema, get_stats, get_sample_json
 from sql_agent import chat
 
 load_dotenv()
@@ -60,7 +63,7 @@ class ChatRequest(BaseModel):
 class ChatResponse(BaseModel):
     text: str
     visualization: str = "none"
-    data: list = []
+    data: Any = []  # result rows; Any so large results are not validated item by item
     columns: list = []
     sql: str | None = None
     row_count: int = 0
@@ -68,6 +71,10 @@ class ChatResponse(BaseModel):
     error: bool = False
 
 
+# The schema never changes at runtime: encode the /api/schema body once
+_SCHEMA_BODY = orjson.dumps({"schema": get_schema()})
+
+
 @app.get("/")
 async def root():
     """Health check endpoint."""
@@ -84,8 +91,9 @@ async def chat_endpoint(request: ChatRequest):
         raise HTTPException(status_code=400, detail="Message cannot be empty")
     
     try:
-        result = chat(request.message)
-        return ChatResponse(**result)
+        # DuckDB and Gemini calls block; run them off the event loop
+        result = await run_in_threadpool(chat, request.message)
+        return ChatResponse.model_construct(**result)
     except Exception as e:
         return ChatResponse(
             text=f"Eroare internă: {str(e)}",
@@ -96,14 +104,14 @@ async def chat_endpoint(request: ChatRequest):
 @app.get("/api/schema")
 async def schema_endpoint():
     """Return database schema for reference."""
-    return {"schema": get_schema()}
+    return Response(content=_SCHEMA_BODY, media_type="application/json")
 
 
 @app.get("/api/stats")
 async def stats_endpoint():
     """Return dashboard statistics."""
     try:
-        stats = get_stats()
+        stats = await run_in_threadpool(get_stats)
         return stats
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -113,7 +121,9 @@ async def stats_endpoint():
 async def sample_endpoint():
     """Return sample data rows."""
     try:
-        return {"data": get_sample_data()}
+        # DuckDB already serialized the body; skip FastAPI's JSON encoding
+        body = await run_in_threadpool(get_sample_json)
+        return Response(content=body, media_type="application/json")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -5,9 +5,16 @@ Smart aggregation: prefers charts/insights over raw data dumps
 """
 
 import os
-import json
 import re
+import time
+import threading
+import unicodedata
 import duckdb
+import numpy as np
+import orjson
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from google import genai
 from google.genai import types
 from dotenv import load_dotenv
@@ -21,9 +28,110 @@ client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
 # Model configuration - Using Gemini 3 Flash for speed + accuracy
 MODEL = "gemini-3-flash-preview"
 
+# Precompiled patterns for cleaning/rewriting model output
+_RE_SQL_TOKEN = re.compile(r"""
+      (?P<str>'(?:[^']|'')*'?)      # string literal, left untouched
+    | (?P<qid>"(?:[^"]|"")*"?)      # quoted identifier, left untouched
+    | (?P<num>\d+(?:\.\d+)?)
+    | (?P<word>\w+)
+    | (?P<ws>\s+)
+    | (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+_RE_WORDS = re.compile(r'[a-z0-9]+')
+_RE_TRAILING_LIMIT = re.compile(r'\s+LIMIT\s+\d+(\s+OFFSET\s+\d+)?\s*;?\s*$', re.IGNORECASE)
+
+# Known valid column names for auto-correction
+_VALID_COLUMNS = frozenset({
+    'nr_reclamatie', 'raion', 'pm', 'observatii', 'nume_client',
+    'nr_comanda', 'id_comanda', 'grup_vanzare', 'furnizor',
+    'echipa_livrare', 'data_factura', 'data_comanda', 'data_reclamatie',
+    'magazin', 'articol_cod', 'id_client', 'articol_denumire',
+    'modalitate_rezolvare', 'motiv_reclamatie', 'descriere',
+    'mod_livrare', 'furnizor_ext', 'responsabil_comanda',
+    'cantitate', 'valoare'
+})
+
+# Close-but-wrong names the model tends to produce
+_NAME_MAP = {
+    'grupa_mediu_vanzare': 'grup_vanzare',
+    'grupa_mediu': 'grup_vanzare',
+    'mediu_vanzare': 'grup_vanzare',
+    'grup_mediu': 'grup_vanzare',
+    'data_reclam': 'data_reclamatie',
+    'data_rec': 'data_reclamatie',
+    'nr_reclam': 'nr_reclamatie',
+    'motiv_reclam': 'motiv_reclamatie',
+    'articol_den': 'articol_denumire',
+    'mod_rezolvare': 'modalitate_rezolvare',
+    'responsabil': 'responsabil_comanda',
+    'echipa': 'echipa_livrare',
+}
 
+def _build_prefix_index(columns) -> dict[str, str]:
+    """Map every unambiguous prefix (4+ chars) of the columns to the full name.
+    Prefixes shared by several columns (e.g. "data_") are left out."""
+    index, ambiguous = {}, set()
+    for column in columns:
+        for end in range(4, len(column) + 1):
+            prefix = column[:end]
+            if index.setdefault(prefix, column) != column:
+                ambiguous.add(prefix)
+    for prefix in ambiguous:
+        del index[prefix]
+    return index
+
+
+_PREFIX_INDEX = _build_prefix_index(_VALID_COLUMNS)
+
+# Result column names that drive visualization choice
+_DETAIL_COLS = frozenset({'nr_reclamatie', 'observatii', 'observatie', 'detalii', 'descriere',
+                          'adresa', 'telefon', 'email', 'client', 'nume_client',
+                          'id', 'nr', 'numar', 'cod'})
+_IDENTIFIER_COLS = _DETAIL_COLS - {'numar'}
+_DATE_COLS = frozenset({'data_reclamatie', 'data'})
+_DETAIL_OR_CONTEXT_COLS = _DETAIL_COLS | _DATE_COLS | {'magazin'}
+_TIME_COLS = frozenset({'luna', 'month', 'an', 'year', 'data', 'zi', 'saptamana', 'trimestru'})
+_NUMERIC_COLS = frozenset({'numar', 'numar_reclamatii', 'total', 'count', 'valoare',
+                           'valoare_totala', 'suma', 'medie', 'procent'})
+
+# The system prompts are static: register them once as Gemini cached content and
+# reference them by name, so each call only pays prefill for the question itself.
+PROMPT_CACHE_TTL = int(os.getenv("GEMINI_CACHE_TTL") or 3600)
+_PROMPT_CACHE_MARGIN = 60  # recreate a cache this many seconds before it expires
+_prompt_caches: dict[str, tuple[str | None, float]] = {}
+_prompt_cache_locks: dict[str, threading.Lock] = {}  # one per prompt; guards its (re)creation
+_prompt_caches_lock = threading.Lock()  # guards _prompt_cache_locks only
+
+# Semantic answer cache: a new question whose embedding is close enough to a
+# previously answered one (and names the same numbers and entities) reuses that answer.
+EMBED_MODEL = "gemini-embedding-001"
+EMBED_DIM = 768
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE") or 10000)  # 0 disables
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD") or 0.92)
+# Ring buffer: row i of the preallocated matrix belongs to _semantic_entries[i];
+# once full, the oldest entry is overwritten
+_semantic_vectors = np.zeros((max(SEMANTIC_CACHE_SIZE, 0), EMBED_DIM), dtype=np.float32)
+_semantic_entries: list[tuple[tuple[str, ...], dict]] = []  # (literals in question, response)
+_semantic_next = 0  # slot the next store writes
+_semantic_lock = threading.Lock()
+# Columns whose values name things (shops, categories, suppliers...); a cached
+# answer is only shared between questions naming the same ones
+_ENTITY_COLUMNS = ('magazin', 'raion', 'furnizor', 'motiv_reclamatie',
+                   'modalitate_rezolvare', 'grup_vanzare', 'mod_livrare')
+
+# Aggregated results above 2x this many rows are sent to the LLM as head + tail samples
+PROMPT_SAMPLE_ROWS = 5
+# Detail (identifier/text) results are sent in full up to this many rows
+PROMPT_DETAIL_ROWS = 60
+
+# Background workers for LLM calls that can overlap DuckDB work within one request
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("LLM_WORKERS") or 8))
+
+
+@lru_cache(maxsize=1)
 def get_sql_system_prompt() -> str:
-    """System prompt for SQL generation - prefers aggregations over raw dumps."""
+    """System prompt for SQL generation - prefers aggregations over raw dumps.
+    The schema is static, so the prompt is built once per process."""
     schema = get_schema()
     return f"""Ești un expert SQL pentru DuckDB. Generează interogări SQL precise bazate pe întrebările utilizatorului.
 
@@ -31,13 +139,23 @@ def get_sql_system_prompt() -> str:
 
 DETECȚIE INTENȚIE (MODURI SPECIALE DE RĂSPUNS):
 1. Daca utilizatorul pune 2 intrebari total diferite in aceeasi propozitie (ex: "Top 10 X si Top 10 Y"), NU genera SQL. 
-   Returneaza DOAR textul: "MULTI_PART"
+   Returneaza intent = "MULTI_PART"
 2. Daca intrebarea este complet irelevanta pentru reclamatii/mobexpert (ex: "Cine e presedintele?", "Care e cea mai rapida masina?", "Invata-ma python"), NU genera SQL.
-   Returneaza DOAR textul: "IRRELEVANT"
-3. Daca intrebarea este valida, genereaza SQL normal conform regulilor de mai jos.
+   Returneaza intent = "IRRELEVANT"
+3. Daca intrebarea este valida, intent = "sql" si genereaza SQL normal conform regulilor de mai jos.
+
+FORMAT RĂSPUNS (JSON):
+{{"intent": "sql" | "MULTI_PART" | "IRRELEVANT", "detail_sql": "...", "agg_sql": "..." sau null}}
+- detail_sql: interogarea care răspunde la întrebare, conform regulilor de mai jos (în EXEMPLE, "A:" este detail_sql)
+- agg_sql: DOAR dacă detail_sql poate returna peste 150 de rânduri brute, o interogare de SUMARIZARE pentru grafic:
+   - Păstrează filtrul WHERE din detail_sql
+   - Dacă e filtrare pe AN → GROUP BY pe LUNI (MONTHNAME); pe LUNĂ → GROUP BY pe ZILE
+   - Dacă nu e filtrare temporală → GROUP BY pe raion sau motiv_reclamatie
+   - COUNT(*) ca metrică principală, ORDER BY logic (cronologic pentru timp, DESC pentru categorii), LIMIT 12
+  Altfel agg_sql = null.
 
 REGULI STRICTE:
-1. Returnează DOAR interogarea SQL, fără explicații
+1. Returnează DOAR obiectul JSON de mai sus, fără explicații
 2. Folosește NUMAI coloanele din schema de mai sus
 3. Pentru date, folosește formatul 'YYYY-MM-DD'
 4. Pentru anul curent, folosește YEAR(data_reclamatie) = 2024 sau 2025
@@ -125,9 +243,20 @@ ORDINEA SORTĂRII:
 """
 
 
-def get_response_system_prompt() -> str:
-    """System prompt for response formatting with smart visualization selection."""
-    return """Ești un asistent executiv pentru analiza reclamațiilor Mobexpert. 
+# Structured output for SQL generation: the query plus, for large raw results, a chart aggregation
+_SQL_RESPONSE_SCHEMA = types.Schema(
+    type="OBJECT",
+    properties={
+        "intent": types.Schema(type="STRING", enum=["sql", "MULTI_PART", "IRRELEVANT"]),
+        "detail_sql": types.Schema(type="STRING", nullable=True),
+        "agg_sql": types.Schema(type="STRING", nullable=True),
+    },
+    required=["intent"],
+)
+
+
+# System prompt for response formatting with smart visualization selection
+_RESPONSE_SYSTEM_PROMPT = """Ești un asistent executiv pentru analiza reclamațiilor Mobexpert. 
 Formatează rezultatele SQL într-un răspuns natural, structurat și profesionist în română.
 
 REGULI DE FORMATARE:
@@ -187,6 +316,7 @@ REGULI DE FORMATARE:
    - Text în engleză (răspunde doar în română)
 
 7. NU inventa date - folosește DOAR ce primești din rezultate
+   - Când primești doar o parte din rânduri, totalurile/min/max "Agregate pe toate rândurile" sunt corecte; folosește-le, nu le recalcula
 
 FORMAT JSON RĂSPUNS:
 {
@@ -198,122 +328,260 @@ FORMAT JSON RĂSPUNS:
 IMPORTANT: Returnează DOAR obiectul JSON valid, fără text suplimentar."""
 
 
-def generate_sql(question: str) -> tuple[str, str | None]:
+# Structured output for format_response: Gemini can only emit JSON of this shape
+_RESPONSE_SCHEMA = types.Schema(
+    type="OBJECT",
+    properties={
+        "text": types.Schema(type="STRING"),
+        "visualization": types.Schema(
+            type="STRING",
+            enum=["none", "table", "bar_chart", "line_chart", "pie_chart"],
+        ),
+        "chart_config": types.Schema(
+            type="OBJECT",
+            properties={
+                "x": types.Schema(type="STRING"),
+                "y": types.Schema(type="STRING"),
+                "title": types.Schema(type="STRING"),
+            },
+            nullable=True,
+        ),
+    },
+    required=["text", "visualization"],
+)
+
+
+def get_response_system_prompt() -> str:
+    """System prompt for response formatting with smart visualization selection."""
+    return _RESPONSE_SYSTEM_PROMPT
+
+
+def _cached_prompt_name(prompt_fn) -> str | None:
+    """Name of the Gemini cache holding prompt_fn()'s text, (re)created near expiry.
+    Returns None when caching is unavailable (e.g. prompt below the minimum size)."""
+    key = prompt_fn.__name__
+    entry = _prompt_caches.get(key)
+    if entry and entry[1] - time.time() > _PROMPT_CACHE_MARGIN:
+        return entry[0]
+    
+    with _prompt_caches_lock:
+        key_lock = _prompt_cache_locks.setdefault(key, threading.Lock())
+    
+    # Only callers of this prompt wait for the Gemini round-trip below
+    with key_lock:
+        # Another thread may have refreshed it while we waited
+        entry = _prompt_caches.get(key)
+        if entry and entry[1] - time.time() > _PROMPT_CACHE_MARGIN:
+            return entry[0]
+        
+        expires = time.time() + PROMPT_CACHE_TTL
+        try:
+            cache = client.caches.create(
+                model=MODEL,
+                config=types.CreateCachedContentConfig(
+                    display_name=key,
+                    system_instruction=prompt_fn(),
+                    ttl=f"{PROMPT_CACHE_TTL}s",
+                )
+            )
+            name = cache.name
+        except Exception as e:
+            # Remember the failure for one TTL instead of retrying on every call
+            print(f"⚠️ Prompt cache unavailable for {key}: {e}")
+            name = None
+        
+        _prompt_caches[key] = (name, expires)
+        return name
+
+
+def _generation_config(prompt_fn, **kwargs) -> types.GenerateContentConfig:
+    """Generation config using the cached system prompt, or sending it inline as fallback."""
+    cache_name = _cached_prompt_name(prompt_fn)
+    if cache_name:
+        return types.GenerateContentConfig(cached_content=cache_name, **kwargs)
+    return types.GenerateContentConfig(system_instruction=prompt_fn(), **kwargs)
+
+
+_AGGREGATE_FUNCTIONS = ('COUNT', 'SUM', 'AVG', 'MIN', 'MAX')
+
+# Keywords/functions the model uses all the time; they never need column correction.
+# DESC is deliberately absent: outside ORDER BY it is a truncated 'descriere'.
+_SQL_KEYWORDS = frozenset({
+    'SELECT', 'FROM', 'WHERE', 'GROUP', 'ORDER', 'HAVING', 'LIMIT', 'OFFSET',
+    'AND', 'NOT', 'NULL', 'IS', 'IN', 'AS', 'ON', 'JOIN', 'LEFT', 'INNER',
+    'WITH', 'DISTINCT', 'CASE', 'WHEN', 'THEN', 'ELSE', 'END', 'BETWEEN',
+    'LIKE', 'ILIKE', 'ASC', 'NULLS', 'LAST', 'FIRST', 'UNION', 'ALL', 'OVER',
+    'PARTITION', 'COUNT', 'SUM', 'AVG', 'MIN', 'MAX', 'ROUND', 'COALESCE',
+    'YEAR', 'MONTH', 'MONTHNAME', 'DAY', 'QUARTER', 'WEEK', 'DATE_TRUNC',
+    'STRFTIME', 'EXTRACT', 'CAST', 'LOWER', 'UPPER', 'TRIM', 'TRUE', 'FALSE',
+})
+
+
+def _looks_like_column(word: str) -> bool:
+    """Plain ASCII word of 3+ letters/underscores, starting and ending with a letter."""
+    return (len(word) >= 3 and word.isascii() and word[0].isalpha()
+            and word[-1].isalpha() and word.replace('_', '').isalpha())
+
+
+def _fix_column_name(word: str) -> str:
+    """Auto-correct a truncated or wrong column name; other words are returned as-is."""
+    lower = word.lower()
+    if lower in _VALID_COLUMNS:
+        return word  # Already valid
+    # Truncated names first, then close names
+    return _PREFIX_INDEX.get(lower) or _NAME_MAP.get(lower, word)
+
+
+def _postprocess_sql(sql: str) -> str:
     """
-    Convert natural language question to SQL.
-    Returns: (sql_query, error_message)
+    Single pass over the generated SQL that:
+    - runs _fix_column_name on column-like words (string literals and quoted names are skipped)
+    - turns 'desc'/'descriere' used as an ORDER BY direction into DESC
+    - injects FROM complaints when missing, and forces LIMIT >= 150 (or adds
+      LIMIT 150 to non-aggregated queries)
     """
-    # Known valid column names for auto-correction
-    VALID_COLUMNS = {
-        'nr_reclamatie', 'raion', 'pm', 'observatii', 'nume_client',
-        'nr_comanda', 'id_comanda', 'grup_vanzare', 'furnizor',
-        'echipa_livrare', 'data_factura', 'data_comanda', 'data_reclamatie',
-        'magazin', 'articol_cod', 'id_client', 'articol_denumire',
-        'modalitate_rezolvare', 'motiv_reclamatie', 'descriere',
-        'mod_livrare', 'furnizor_ext', 'responsabil_comanda',
-        'cantitate', 'valoare'
-    }
+    parts = []
+    prev = ''  # previous significant token, upper-cased
+    prev_at = 0  # its index in parts
+    depth = 0
+    order_by_depth = None  # paren depth of the ORDER BY we're in, if any
+    first_word = None  # upper-cased, for the SELECT check
+    has_from = has_limit = has_aggregation = False
+    clause_at = {}  # first top-level WHERE/GROUP BY/ORDER BY/LIMIT -> index in parts
+    limit_at = []  # indices of the LIMIT <n> literals
     
+    for match in _RE_SQL_TOKEN.finditer(sql):
+        kind, tok = match.lastgroup, match.group()
+        if kind == 'ws':
+            parts.append(tok)
+            continue
+        
+        upper = tok
+        if kind == 'word':
+            upper = tok.upper()
+            if first_word is None:
+                first_word = upper
+            if order_by_depth is not None and upper in ('DESC', 'DESCRIERE') and prev not in ('BY', ','):
+                tok = upper = 'DESC'
+            elif upper not in _SQL_KEYWORDS and _looks_like_column(tok):
+                fixed = _fix_column_name(tok)
+                if fixed is not tok:
+                    tok, upper = fixed, fixed.upper()
+            
+            if upper == 'FROM':
+                has_from = True
+            elif upper == 'LIMIT':
+                has_limit = True
+                order_by_depth = None
+                if depth == 0:
+                    clause_at.setdefault('LIMIT', len(parts))
+            elif upper == 'WHERE' and depth == 0:
+                clause_at.setdefault('WHERE', len(parts))
+            elif upper == 'BY' and prev in ('GROUP', 'ORDER'):
+                if prev == 'GROUP':
+                    has_aggregation = True
+                else:
+                    order_by_depth = depth
+                if depth == 0:
+                    clause_at.setdefault(prev, prev_at)
+        elif kind == 'num':
+            if prev == 'LIMIT':
+                limit_at.append(len(parts))
+        elif tok == '(':
+            if prev in _AGGREGATE_FUNCTIONS:
+                has_aggregation = True
+            depth += 1
+        elif tok == ')':
+            depth -= 1
+            if order_by_depth is not None and depth < order_by_depth:
+                order_by_depth = None
+        elif tok == ';':
+            order_by_depth = None
+        
+        prev, prev_at = upper, len(parts)
+        parts.append(tok)
+    
+    # FORCE MINIMUM LIMIT 150
+    if limit_at and float(parts[limit_at[0]]) < 150:
+        for i in limit_at:
+            parts[i] = '150'
+    
+    # CRITICAL: Check for missing FROM clause and auto-fix
+    from_at_end = False
+    if not has_from and first_word == 'SELECT':
+        # Inject FROM complaints before WHERE/GROUP BY/ORDER BY/LIMIT or at end
+        for keyword in ('WHERE', 'GROUP', 'ORDER', 'LIMIT'):
+            if keyword in clause_at:
+                parts.insert(clause_at[keyword], 'FROM complaints ')
+                break
+        else:
+            from_at_end = True
+    
+    sql = ''.join(parts)
+    if from_at_end:
+        sql = sql.rstrip(';') + ' FROM complaints'
+    # Safety: inject LIMIT if missing and query doesn't have aggregation
+    if not has_aggregation and not has_limit:
+        sql = sql.rstrip(';') + ' LIMIT 150'
+    return sql
+
+
+def _sql_config(max_output_tokens: int) -> types.GenerateContentConfig:
+    """JSON-mode generation config for the SQL system prompt."""
+    return _generation_config(
+        get_sql_system_prompt,
+        temperature=0.1,  # Low temperature for accuracy
+        max_output_tokens=max_output_tokens,
+        response_mime_type="application/json",
+        response_schema=_SQL_RESPONSE_SCHEMA,
+    )
+
+
+def _as_select(sql: str | None) -> str | None:
+    """The statement without trailing ';', or None unless it's a SELECT/WITH query."""
+    sql = (sql or "").strip().rstrip(';').strip()
+    return sql if sql[:6].upper().startswith(('SELECT', 'WITH')) else None
+
+
+def generate_sql(question: str) -> tuple[str, str | None, str | None]:
+    """
+    Convert natural language question to SQL.
+    The same call also returns an aggregation query to chart large raw results.
+    Returns: (sql_query, agg_sql, error_message)
+    """
     try:
         response = client.models.generate_content(
             model=MODEL,
             contents=question,
-            config=types.GenerateContentConfig(
-                system_instruction=get_sql_system_prompt(),
-                temperature=0.1,  # Low temperature for accuracy
-                max_output_tokens=1000,
-            )
+            config=_sql_config(max_output_tokens=1000)
         )
-        
-        sql = response.text.strip()
+        reply = orjson.loads(response.text)
         
         # Handle Intent Flags
-        if "MULTI_PART" in sql:
-            return "", "Te rog să îmi adresezi câte o singură întrebare pe rând. (Ex: 'Top 10...' și apoi 'Cele mai scumpe...')"
-        if "IRRELEVANT" in sql:
-            return "", "Nu am informații despre acest subiect. Răspund doar la întrebări despre reclamațiile Mobexpert."
-        
-        # Clean up SQL (remove markdown code blocks if present)
-        sql = re.sub(r'^```sql\s*', '', sql)
-        sql = re.sub(r'^```\s*', '', sql)
-        sql = re.sub(r'\s*```$', '', sql)
-        sql = sql.strip()
+        intent = reply.get("intent")
+        if intent == "MULTI_PART":
+            return "", None, "Te rog să îmi adresezi câte o singură întrebare pe rând. (Ex: 'Top 10...' și apoi 'Cele mai scumpe...')"
+        if intent == "IRRELEVANT":
+            return "", None, "Nu am informații despre acest subiect. Răspund doar la întrebări despre reclamațiile Mobexpert."
         
         # Basic validation
-        if not sql.upper().startswith(('SELECT', 'WITH')):
-            return "", f"Invalid SQL generated: {sql[:100]}"
+        sql = _as_select(reply.get("detail_sql"))
+        if not sql:
+            return "", None, f"Invalid SQL generated: {str(reply.get('detail_sql'))[:100]}"
         
-        # Auto-correct truncated or wrong column names
-        def fix_column_name(match):
-            word = match.group(0)
-            if word.lower() in VALID_COLUMNS:
-                return word  # Already valid
-            # Try prefix matching for truncated names
-            for valid in VALID_COLUMNS:
-                if valid.startswith(word.lower()) and len(word) >= 4:
-                    return valid
-            # Try fuzzy matching for close names
-            name_map = {
-                'grupa_mediu_vanzare': 'grup_vanzare',
-                'grupa_mediu': 'grup_vanzare',
-                'mediu_vanzare': 'grup_vanzare',
-                'grup_mediu': 'grup_vanzare',
-                'data_reclam': 'data_reclamatie',
-                'data_rec': 'data_reclamatie',
-                'nr_reclam': 'nr_reclamatie',
-                'motiv_reclam': 'motiv_reclamatie',
-                'articol_den': 'articol_denumire',
-                'mod_rezolvare': 'modalitate_rezolvare',
-                'responsabil': 'responsabil_comanda',
-                'echipa': 'echipa_livrare',
-            }
-            if word.lower() in name_map:
-                return name_map[word.lower()]
-            return word
-        
-        # Fix column names in SQL (match word-like patterns that look like column names)
-        sql = re.sub(r'\b[a-z][a-z_]+[a-z]\b', fix_column_name, sql, flags=re.IGNORECASE)
+        # Fix column names, ORDER BY direction, missing FROM and LIMIT in one pass
+        sql = _postprocess_sql(sql)
         
-        # CRITICAL FIX: Replace 'descriere' with 'DESC' in ORDER BY clauses if used as a keyword
-        # Matches "ORDER BY ... descriere" or "ORDER BY ... descriere LIMIT"
-        sql = re.sub(r'(ORDER\s+BY\s+[\w\(\)]+\s+)descriere(\s+LIMIT|\s*$)', r'\1DESC\2', sql, flags=re.IGNORECASE)
-        
-        # CRITICAL: Check for missing FROM clause and auto-fix
-        sql_upper = sql.upper()
-        if 'FROM' not in sql_upper and sql_upper.startswith('SELECT'):
-            # Inject FROM complaints before WHERE/GROUP BY/ORDER BY/LIMIT or at end
-            for keyword in ['WHERE', 'GROUP BY', 'ORDER BY', 'LIMIT']:
-                if keyword in sql_upper:
-                    idx = sql_upper.index(keyword)
-                    sql = sql[:idx] + 'FROM complaints ' + sql[idx:]
-                    break
-            else:
-                sql = sql.rstrip(';') + ' FROM complaints'
-            sql_upper = sql.upper()
-        
-        # Safety: inject LIMIT if missing and query doesn't have aggregation
-        has_aggregation = any(fn in sql_upper for fn in ['COUNT(', 'SUM(', 'AVG(', 'MIN(', 'MAX(', 'GROUP BY'])
-        # FORCE MINIMUM LIMIT 150
-        has_limit = 'LIMIT' in sql_upper
-        limit_match = re.search(r'LIMIT\s+(\d+)', sql, re.IGNORECASE)
-        if limit_match:
-            current_limit = int(limit_match.group(1))
-            if current_limit < 150:
-                 sql = re.sub(r'LIMIT\s+\d+', 'LIMIT 150', sql, flags=re.IGNORECASE)
-        
-        if not has_aggregation and not has_limit:
-            sql = sql.rstrip(';') + ' LIMIT 150'
-        
-        return sql, None
+        return sql, _as_select(reply.get("agg_sql")), None
         
     except Exception as e:
-        return "", f"Error generating SQL: {str(e)}"
+        return "", None, f"Error generating SQL: {str(e)}"
 
 
 def generate_chart_query(question: str, original_sql: str, row_count: int) -> str | None:
     """
-    If the original query returned too many raw rows (>20),
-    generate a smarter aggregation query for chart display.
+    If the original query returned too many raw rows and generate_sql gave no
+    agg_sql, generate a smarter aggregation query for chart display.
     Returns: aggregation SQL or None
     """
     try:
@@ -332,41 +600,146 @@ Generează o interogare SQL de SUMARIZARE care:
 4. ORDER BY logic (cronologic pentru timp, DESC pentru categorii)
 5. LIMIT 12
 
-Returnează DOAR SQL-ul, fără explicații."""
+Pune interogarea de sumarizare în agg_sql."""
 
         response = client.models.generate_content(
             model=MODEL,
             contents=prompt,
-            config=types.GenerateContentConfig(
-                system_instruction=get_sql_system_prompt(),
-                temperature=0.1,
-                max_output_tokens=300,
-            )
+            config=_sql_config(max_output_tokens=300)
         )
-        
-        agg_sql = response.text.strip()
-        agg_sql = re.sub(r'^```sql\s*', '', agg_sql)
-        agg_sql = re.sub(r'^```\s*', '', agg_sql)
-        agg_sql = re.sub(r'\s*```$', '', agg_sql)
-        agg_sql = agg_sql.strip()
-        
-        if agg_sql.upper().startswith(('SELECT', 'WITH')):
-            return agg_sql
-        return None
+        reply = orjson.loads(response.text)
+        return _as_select(reply.get("agg_sql") or reply.get("detail_sql"))
         
     except Exception:
         return None
 
 
+# DuckDB names unaliased aggregates after the call ("count_star()", "sum(valoare)")
+_RE_AGGREGATE_NAME = re.compile(r'(\w+)\((?:DISTINCT\s+)?(\w*)\)', re.IGNORECASE)
+_AGGREGATE_LABELS = {
+    'count_star': 'Număr reclamații',
+    'count': 'Număr',
+    'sum': 'Total',
+    'avg': 'Medie',
+    'min': 'Minim',
+    'max': 'Maxim',
+}
+
+
+def _result_label(column: str) -> str | None:
+    """Readable label for a result column, or None for an expression we can't name."""
+    if '(' not in column:
+        return column.replace('_', ' ').capitalize()
+    match = _RE_AGGREGATE_NAME.fullmatch(column)
+    if not match or match[1].lower() not in _AGGREGATE_LABELS:
+        return None
+    function, argument = match[1].lower(), match[2].lower()
+    if function == 'count' and argument == 'nr_reclamatie':
+        function, argument = 'count_star', ''
+    label = _AGGREGATE_LABELS[function]
+    return f"{label} {argument.replace('_', ' ')}" if argument else label
+
+
+def _format_number(value: int | float) -> str:
+    """Romanian number format: 1.234.567 / 1.234,56"""
+    if isinstance(value, float) and not value.is_integer():
+        return f"{value:,.2f}".replace(",", " ").replace(".", ",").replace(" ", ".")
+    return f"{int(value):,}".replace(",", ".")
+
+
+def _format_scalar_result(results: list[dict], columns: list[str]) -> str | None:
+    """Text for a single row of one or two numeric aggregates, or None for anything else."""
+    if len(results) != 1 or not 1 <= len(columns) <= 2:
+        return None
+    # Identifiers (nr_reclamatie, id_client, ...) are not quantities
+    if any(c.lower() in _IDENTIFIER_COLS or c.lower().startswith(('nr_', 'id_')) for c in columns):
+        return None
+    values = [results[0].get(col) for col in columns]
+    if not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+        return None
+    # Unaliased expressions (round(...), year(...)) are left to the LLM to phrase
+    labels = [_result_label(col) for col in columns]
+    if None in labels:
+        return None
+    
+    lines = []
+    for col, label, value in zip(columns, labels, values):
+        col_lower = col.lower()
+        if col_lower in _TIME_COLS:
+            # Years/months are labels, not quantities: no thousands separator
+            formatted = f"**{value}**"
+        elif 'valoare' in col_lower or 'suma' in col_lower:
+            formatted = f"**{_format_number(value)} RON**"
+        elif 'reclamatii' in col_lower or col_lower in ('count', 'count_star()', 'numar'):
+            formatted = f"**{_format_number(value)} reclamații**"
+        else:
+            formatted = f"**{_format_number(value)}**"
+        lines.append((label, formatted))
+    
+    if len(lines) == 1:
+        return f"Rezultat: {lines[0][1]}"
+    return "\n".join(f"• {label}: {formatted}" for label, formatted in lines)
+
+
+def _column_stats(results: list[dict], columns: list[str]) -> str:
+    """Min/max/sum of numeric columns and top 5 values of repeated text columns, one line each."""
+    lines = []
+    for col in columns:
+        values = [r[col] for r in results if r.get(col) not in (None, "")]
+        if not values:
+            continue
+        if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+            low, high, total = (round(v, 2) for v in (min(values), max(values), sum(values)))
+            lines.append(f"- {col}: min {low}, max {high}, sumă {total}")
+        else:
+            top = Counter(str(v) for v in values).most_common(5)
+            if top[0][1] > 1:
+                lines.append(f"- {col} (top 5): " + ", ".join(f"{k} ({v})" for k, v in top))
+    return "\n".join(lines)
+
+
 def format_response(question: str, sql: str, results: list[dict], columns: list[str],
                     total_count: int | None = None) -> dict:
     """
     Format query results into a natural language response.
     Returns: {text, visualization, data, chart_config}
     """
+    # A lone number (COUNT/SUM/AVG...) needs no LLM to be phrased
+    scalar_text = _format_scalar_result(results, columns)
+    if scalar_text:
+        return {
+            "text": scalar_text,
+            "visualization": "none",
+            "data": results,
+            "columns": columns,
+            "sql": sql,
+            "row_count": len(results)
+        }
+    
     try:
-        # Prepare context for LLM - INCREASED CONTEXT TO 100 ROWS
-        result_summary = json.dumps(results[:100], default=str, ensure_ascii=False)
+        # Identifier/detail data (nr_reclamatie, observatii, ...) is listed in full by the model
+        cols_lower = {col.lower() for col in columns}
+        is_detail = not cols_lower.isdisjoint(_DETAIL_COLS)
+        
+        # Prepare context for LLM: detail rows in full (up to the 60 we list),
+        # aggregates as a head/tail sample plus pre-computed column stats
+        if is_detail:
+            prompt_rows = results[:PROMPT_DETAIL_ROWS]
+        elif len(results) > PROMPT_SAMPLE_ROWS * 2:
+            prompt_rows = results[:PROMPT_SAMPLE_ROWS] + results[-PROMPT_SAMPLE_ROWS:]
+        else:
+            prompt_rows = results
+        result_summary = orjson.dumps(prompt_rows, default=str).decode()
+        
+        rows_info = aggregates_text = ""
+        if len(prompt_rows) < len(results):
+            # Describe the slice actually sent, so the model lists only what it has
+            if is_detail:
+                rows_info = (f" - doar primele {len(prompt_rows)} afișate; listează-le pe acestea"
+                             f" și menționează că restul de {len(results) - len(prompt_rows)} nu sunt incluse")
+            else:
+                rows_info = f" - primele și ultimele {PROMPT_SAMPLE_ROWS} afișate"
+            aggregates_text = f"\nAgregate pe toate rândurile:\n{_column_stats(results, columns)}"
         
         count_info = ""
         if total_count and total_count != len(results):
@@ -376,9 +749,8 @@ def format_response(question: str, sql: str, results: list[dict], columns: list[
         stats_text = ""
         mag_col = next((c for c in columns if 'magazin' in c.lower()), None)
         if mag_col and len(results) > 1:
-            from collections import Counter
-            counts = Counter(str(r[mag_col]) for r in results if r.get(mag_col))
-            top_counts = counts.most_common()
+            # results is capped by the forced LIMIT, so counting here is cheaper than a query
+            top_counts = Counter(str(r[mag_col]) for r in results if r.get(mag_col)).most_common()
             stats_list = "\n".join(f"- {k}: {v}" for k, v in top_counts)
             stats_text = f"\n\nSTATISTICI PRE-CALCULATE (FOLOSEȘTE-LE PE ACESTEA, NU NUMĂRA TU):\nDistribuție magazine:\n{stats_list}\n"
         
@@ -386,9 +758,9 @@ def format_response(question: str, sql: str, results: list[dict], columns: list[
 
 SQL executat: {sql}
 
-Rezultate ({len(results)} rânduri):
+Rezultate ({len(results)} rânduri){rows_info}:
 {result_summary}
-{count_info}
+{aggregates_text}{count_info}
 {stats_text}
 Coloane: {columns}
 
@@ -429,74 +801,37 @@ DOAR JSON valid, nimic altceva."""
         response = client.models.generate_content(
             model=MODEL,
             contents=prompt,
-            config=types.GenerateContentConfig(
-                system_instruction=get_response_system_prompt(),
+            config=_generation_config(
+                get_response_system_prompt,
                 temperature=0.3,
-                max_output_tokens=4000,
+                # Detail lists run up to 60 bullets, and thinking tokens share the cap
+                max_output_tokens=4000 if is_detail else 1500,
+                response_mime_type="application/json",
+                response_schema=_RESPONSE_SCHEMA,
             )
         )
         
-        # Parse JSON response
-        response_text = response.text.strip()
-        
-        # Clean up JSON (remove markdown code blocks if present)
-        response_text = re.sub(r'^```json\s*', '', response_text, flags=re.MULTILINE)
-        response_text = re.sub(r'^```\s*', '', response_text, flags=re.MULTILINE)
-        response_text = re.sub(r'\s*```$', '', response_text)
-        response_text = response_text.strip()
-        
-        parsed = None
-        
-        # Try to parse as JSON
+        # JSON mode: the reply is constrained to _RESPONSE_SCHEMA
         try:
-            parsed = json.loads(response_text)
-        except json.JSONDecodeError:
-            # Try to find JSON object in the response
-            json_match = re.search(r'\{[^{}]*"text"\s*:\s*"[^"]*"[^{}]*\}', response_text, re.DOTALL)
-            if json_match:
-                try:
-                    parsed = json.loads(json_match.group())
-                except json.JSONDecodeError:
-                    pass
-            
-            # If still not parsed, try to extract just the text field
-            if not parsed:
-                text_match = re.search(r'"text"\s*:\s*"([^"]*)"', response_text)
-                if text_match:
-                    parsed = {
-                        "text": text_match.group(1),
-                        "visualization": _guess_visualization(results, columns)
-                    }
-                else:
-                    # Last resort
-                    clean_text = re.sub(r'^\s*\{\s*"text"\s*:\s*"?', '', response_text)
-                    clean_text = re.sub(r'"?\s*,?\s*"visualization".*$', '', clean_text, flags=re.DOTALL)
-                    clean_text = clean_text.strip().strip('"').strip()
-                    if clean_text:
-                        parsed = {
-                            "text": clean_text,
-                            "visualization": _guess_visualization(results, columns)
-                        }
-                    else:
-                        parsed = {
-                            "text": f"Am găsit {len(results)} rezultate.",
-                            "visualization": _guess_visualization(results, columns)
-                        }
+            parsed = orjson.loads(response.text)
+        except (orjson.JSONDecodeError, TypeError):
+            # Only happens when the reply was cut off at max_output_tokens
+            parsed = {
+                "text": f"Am găsit {len(results)} rezultate.",
+                "visualization": _guess_visualization(results, columns, cols_lower),
+                "error": True  # a degraded answer; keep it out of the semantic cache
+            }
         
         # Ensure text field exists and is clean
         if "text" in parsed:
             parsed["text"] = parsed["text"].replace('\\"', '"')
         
-        # Override visualization if LLM chose wrong
+        # Override visualization if LLM chose wrong (never the case for the
+        # fallback above: the guess only returns "table" for <= 15 rows)
         if parsed.get("visualization") == "table" and len(results) > 15:
-            parsed["visualization"] = _guess_visualization(results, columns)
+            parsed["visualization"] = _guess_visualization(results, columns, cols_lower)
         
         # Force correct visualization for identifier/detail data
-        detail_cols = {'nr_reclamatie', 'observatii', 'observatie', 'detalii', 'descriere',
-                       'adresa', 'telefon', 'email', 'client', 'nume_client', 'id', 'nr', 'numar', 'cod'}
-        cols_lower = {col.lower() for col in columns}
-        is_detail = bool(cols_lower.intersection(detail_cols))
-        
         if is_detail and parsed.get("visualization") not in ("none", "table"):
             parsed["visualization"] = "none"
         
@@ -504,19 +839,19 @@ DOAR JSON valid, nimic altceva."""
         if is_detail and parsed.get("visualization") == "none" and len(results) <= 60:
             # Check if values are actually in the text
             text = parsed.get("text", "")
-            values = [str(list(r.values())[0]) for r in results if r]
-            missing = [v for v in values if v not in text]
+            first_key = next(iter(results[0]))
+            values = [str(r[first_key]) for r in results if r]
             
             # If ANY value is missing from text, force full list injection
-            if len(missing) > 0:
+            # (stops at the first missing one; which ones are missing doesn't matter)
+            if any(v not in text for v in values):
                 # Find observatii/magazin columns safely
-                keys = list(results[0].keys())
-                obs_key = next((k for k in keys if 'observ' in k.lower()), None)
-                mag_key = next((k for k in keys if 'magazin' in k.lower()), None)
+                obs_key = next((k for k in results[0] if 'observ' in k.lower()), None)
+                mag_key = next((k for k in results[0] if 'magazin' in k.lower()), None)
                 
                 lines = []
                 for r in results:
-                    val = str(list(r.values())[0])
+                    val = str(r[first_key])
                     line = f"• {val}"
                     if mag_key and r.get(mag_key):
                         line += f" ({r[mag_key]})"
@@ -554,48 +889,46 @@ DOAR JSON valid, nimic altceva."""
             "data": results,
             "columns": columns,
             "sql": sql,
-            "row_count": len(results)
+            "row_count": len(results),
+            "error": True
         }
 
 
-def _guess_visualization(results: list[dict], columns: list[str]) -> str:
-    """Guess the best visualization type based on data shape."""
+def _guess_visualization(results: list[dict], columns: list[str],
+                         cols_lower: set[str] | None = None) -> str:
+    """Guess the best visualization type based on data shape.
+    cols_lower: the lower-cased column names, if the caller already has them."""
     if not results or len(results) == 0:
         return "none"
     if len(results) == 1 and len(columns) <= 2:
         return "none"  # Single value, just show text
     
     # Detect identifier / detail columns → never chart these
-    detail_cols = {'nr_reclamatie', 'observatii', 'observatie', 'detalii', 'descriere',
-                   'adresa', 'telefon', 'email', 'client', 'nume_client',
-                   'id', 'nr', 'numar', 'cod'}
-    cols_lower = {col.lower() for col in columns}
+    if cols_lower is None:
+        cols_lower = {col.lower() for col in columns}
     
     # CRITICAL: If we have 'observatii', it's a detail query -> text list only
     if 'observatii' in cols_lower or 'observatie' in cols_lower:
         return "none"
     
     # If ALL columns are identifiers or detail text → no chart, just text
-    if cols_lower.issubset(detail_cols | {'data_reclamatie', 'data', 'magazin'}):
+    if cols_lower <= _DETAIL_OR_CONTEXT_COLS:
         return "none"
     
     # If the only non-date column is an identifier → no chart
-    non_date_cols = cols_lower - {'data_reclamatie', 'data'}
-    if non_date_cols and non_date_cols.issubset(detail_cols):
+    non_date_cols = cols_lower - _DATE_COLS
+    if non_date_cols and non_date_cols <= _DETAIL_COLS:
         return "none"
     
     # If single column and it's identifiers → no chart
-    if len(columns) == 1 and cols_lower.intersection(detail_cols):
+    if len(columns) == 1 and not cols_lower.isdisjoint(_DETAIL_COLS):
         return "none"
     
     # Check for time-based columns
-    time_cols = {'luna', 'month', 'an', 'year', 'data', 'zi', 'saptamana', 'trimestru'}
-    has_time = any(col.lower() in time_cols for col in columns)
+    has_time = not cols_lower.isdisjoint(_TIME_COLS)
     
     # Check if we have numeric aggregation columns
-    numeric_cols = {'numar', 'numar_reclamatii', 'total', 'count', 'valoare',
-                    'valoare_totala', 'suma', 'medie', 'procent'}
-    has_numeric = any(col.lower() in numeric_cols for col in columns)
+    has_numeric = not cols_lower.isdisjoint(_NUMERIC_COLS)
     
     # Need at least one numeric column for charts to make sense
     if not has_numeric:
@@ -618,13 +951,111 @@ def _guess_visualization(results: list[dict], columns: list[str]) -> str:
     return "bar_chart"
 
 
+def _embed_question(question: str) -> np.ndarray | None:
+    """Unit-length embedding of the question, or None if the embedding call fails."""
+    try:
+        result = client.models.embed_content(
+            model=EMBED_MODEL,
+            contents=question,
+            config=types.EmbedContentConfig(
+                task_type="SEMANTIC_SIMILARITY",
+                output_dimensionality=EMBED_DIM,
+            )
+        )
+    except Exception as e:
+        print(f"⚠️ Question embedding failed: {e}")
+        return None
+    
+    vec = np.asarray(result.embeddings[0].values, dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else None
+
+
+def _fold(text: str) -> str:
+    """Lower-case text without diacritics ("Brașov" -> "brasov")."""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+@lru_cache(maxsize=1)
+def _entity_words() -> frozenset[str]:
+    """Words (3+ letters) of the distinct entity values in the table, loaded once."""
+    union = " UNION ".join(f"SELECT DISTINCT {col} AS v FROM complaints" for col in _ENTITY_COLUMNS)
+    rows, _, error = execute_query(union)
+    if error:
+        print(f"⚠️ Entity vocabulary unavailable: {error}")
+        return frozenset()
+    return frozenset(w for r in rows for w in _RE_WORDS.findall(_fold(r["v"] or "")) if len(w) >= 3)
+
+
+def _question_literals(question: str) -> tuple[str, ...]:
+    """Numbers/codes and entity words in a question. They barely move the embedding
+    ("2023" vs "2024", "Brașov" vs "Cluj"), so cache hits must match them exactly."""
+    vocabulary = _entity_words()
+    words = _RE_WORDS.findall(_fold(question))
+    codes = [w for w in words if any(c.isdigit() for c in w)]
+    # Inflected forms count as their entity: "brasovului" names the "brasov" shop
+    entities = {v for w in words for v in vocabulary if w.startswith(v)}
+    return tuple(codes) + tuple(sorted(entities))
+
+
+def _semantic_cache_lookup(vec: np.ndarray, literals: tuple[str, ...]) -> dict | None:
+    """Best cached response above the similarity threshold whose question has the same literals."""
+    with _semantic_lock:
+        if not _semantic_entries:
+            return None
+        scores = _semantic_vectors[:len(_semantic_entries)] @ vec
+        hits = np.flatnonzero(scores >= SEMANTIC_CACHE_THRESHOLD)
+        for i in hits[np.argsort(-scores[hits])]:
+            cached_literals, response = _semantic_entries[i]
+            if cached_literals == literals:
+                return dict(response)
+    return None
+
+
+def _semantic_cache_store(vec: np.ndarray, literals: tuple[str, ...], response: dict):
+    """Remember a response, overwriting the oldest entry when full."""
+    global _semantic_next
+    with _semantic_lock:
+        slot = _semantic_next
+        _semantic_vectors[slot] = vec
+        if slot < len(_semantic_entries):
+            _semantic_entries[slot] = (literals, response)
+        else:
+            _semantic_entries.append((literals, response))
+        _semantic_next = (slot + 1) % SEMANTIC_CACHE_SIZE
+
+
 def chat(question: str) -> dict:
     """
     Main chat function - process question and return formatted response.
+    Near-duplicates of already answered questions are served from the semantic cache.
+    """
+    if SEMANTIC_CACHE_SIZE <= 0:
+        return _answer(question)
+    
+    vec = _embed_question(question)
+    if vec is None:
+        return _answer(question)
+    
+    literals = _question_literals(question)
+    cached = _semantic_cache_lookup(vec, literals)
+    if cached is not None:
+        return cached
+    
+    response = _answer(question)
+    if not response.get("error"):
+        _semantic_cache_store(vec, literals, response)
+    return response
+
+
+def _answer(question: str) -> dict:
+    """
+    Generate, run and format the SQL for a question.
     Smart logic: if query returns too many raw rows, auto-aggregate for chart.
     """
     # Step 1: Generate SQL
-    sql, sql_error = generate_sql(question)
+    sql, agg_sql, sql_error = generate_sql(question)
     if sql_error:
         return {
             "text": f"Nu am putut genera interogarea SQL: {sql_error}",
@@ -668,17 +1099,23 @@ def chat(question: str) -> dict:
     # Step 4: SMART REDIRECT - If too many raw rows, auto-aggregate
     total_count = len(results)
     if total_count >= 150:
+        # Aggregation query: usually generated together with the SQL; otherwise ask
+        # for one now, overlapping the LLM round-trip with the count query
+        agg_future = None
+        if not agg_sql:
+            agg_future = _executor.submit(generate_chart_query, question, sql, total_count)
+        
         # Get the real total count
         count_sql = _extract_count_query(sql)
         if count_sql:
             count_results, _, _ = execute_query(count_sql)
             if count_results and len(count_results) == 1:
-                first_val = list(count_results[0].values())[0]
+                first_val = next(iter(count_results[0].values()))
                 if isinstance(first_val, (int, float)):
                     total_count = int(first_val)
         
-        # Generate a smarter aggregation query
-        agg_sql = generate_chart_query(question, sql, total_count)
+        if agg_future:
+            agg_sql = agg_future.result()
         if agg_sql:
             agg_results, agg_columns, agg_error = execute_query(agg_sql)
             if not agg_error and agg_results:
@@ -693,26 +1130,11 @@ def chat(question: str) -> dict:
 
 
 def _extract_count_query(sql: str) -> str | None:
-    """Extract a COUNT(*) version of the given SQL query."""
-    try:
-        # Replace SELECT ... FROM with SELECT COUNT(*) FROM
-        count_sql = re.sub(
-            r'SELECT\s+.*?\s+FROM',
-            'SELECT COUNT(*) as total FROM',
-            sql,
-            count=1,
-            flags=re.IGNORECASE | re.DOTALL
-        )
-        # Remove ORDER BY, LIMIT, GROUP BY
-        count_sql = re.sub(r'\s+ORDER\s+BY\s+.*$', '', count_sql, flags=re.IGNORECASE)
-        count_sql = re.sub(r'\s+LIMIT\s+\d+', '', count_sql, flags=re.IGNORECASE)
-        count_sql = re.sub(r'\s+GROUP\s+BY\s+.*?(?=\s+HAVING|\s+ORDER|\s+LIMIT|$)', '', count_sql, flags=re.IGNORECASE)
-        
-        if count_sql.upper().startswith('SELECT'):
-            return count_sql
-        return None
-    except Exception:
+    """COUNT(*) of all rows the given query would return without its final LIMIT."""
+    inner = _RE_TRAILING_LIMIT.sub('', sql).rstrip().rstrip(';')
+    if not inner[:6].upper().startswith(('SELECT', 'WITH')):
         return None
+    return f"SELECT COUNT(*) AS total FROM ({inner}) _cnt"
 
 
 # Test function
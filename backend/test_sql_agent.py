@@ -0,0 +1,158 @@
+"""
+Tests for the SQL agent's local (non-LLM) helpers.
+Run from backend/: python -m unittest
+"""
+
+import os
+import unittest
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+import duckdb
+import numpy as np
+
+os.environ.setdefault("GOOGLE_API_KEY", "test")  # the client is built at import time
+
+import sql_agent
+from database import _arrow_to_rows
+from sql_agent import _extract_count_query, _format_scalar_result, _postprocess_sql
+
+
+class FormatScalarResultTest(unittest.TestCase):
+    def test_year_is_printed_raw(self):
+        text = _format_scalar_result([{"an": 2024, "numar": 8187}], ["an", "numar"])
+        self.assertEqual(text, "• An: **2024**\n• Numar: **8.187 reclamații**")
+
+    def test_unaliased_aggregates_get_labels(self):
+        text = _format_scalar_result([{"count_star()": 5, "sum(valoare)": 1234.5}],
+                                     ["count_star()", "sum(valoare)"])
+        self.assertEqual(text, "• Număr reclamații: **5 reclamații**\n• Total valoare: **1.234,50 RON**")
+
+    def test_unknown_expression_goes_to_llm(self):
+        self.assertIsNone(_format_scalar_result([{"round(sum(valoare), 2)": 5}], ["round(sum(valoare), 2)"]))
+
+
+class PostprocessSqlTest(unittest.TestCase):
+    def test_desc_directions_on_several_keys(self):
+        sql = _postprocess_sql(
+            "SELECT magazin, data_reclamatie FROM complaints "
+            "ORDER BY data_reclamatie desc, magazin descriere LIMIT 10"
+        )
+        self.assertEqual(sql, "SELECT magazin, data_reclamatie FROM complaints "
+                              "ORDER BY data_reclamatie DESC, magazin DESC LIMIT 150")
+
+    def test_nulls_last_desc_is_kept(self):
+        sql = _postprocess_sql(
+            "SELECT magazin, COUNT(*) AS n FROM complaints GROUP BY magazin "
+            "ORDER BY n NULLS LAST DESC, magazin DESC LIMIT 5"
+        )
+        self.assertEqual(sql, "SELECT magazin, COUNT(*) AS n FROM complaints GROUP BY magazin "
+                              "ORDER BY n NULLS LAST DESC, magazin DESC LIMIT 150")
+
+    def test_descriere_sort_key_is_not_a_direction(self):
+        sql = _postprocess_sql("SELECT descriere FROM complaints ORDER BY valoare DESC NULLS LAST, descriere")
+        self.assertEqual(sql, "SELECT descriere FROM complaints ORDER BY valoare DESC NULLS LAST, descriere LIMIT 150")
+
+    def test_truncated_names_missing_from_and_literals(self):
+        sql = _postprocess_sql("SELECT nr_reclam, motiv_reclam WHERE raion = 'desc'")
+        self.assertEqual(sql, "SELECT nr_reclamatie, motiv_reclamatie FROM complaints WHERE raion = 'desc' LIMIT 150")
+
+    def test_aggregate_gets_no_limit(self):
+        self.assertEqual(_postprocess_sql("SELECT COUNT(*) FROM complaints"), "SELECT COUNT(*) FROM complaints")
+
+
+class ExtractCountQueryTest(unittest.TestCase):
+    def test_trailing_limit_is_dropped(self):
+        self.assertEqual(_extract_count_query("SELECT * FROM complaints WHERE raion = 'X' LIMIT 150;"),
+                         "SELECT COUNT(*) AS total FROM (SELECT * FROM complaints WHERE raion = 'X') _cnt")
+
+    def test_limit_offset_and_cte(self):
+        self.assertEqual(_extract_count_query("WITH t AS (SELECT 1) SELECT * FROM t LIMIT 150 OFFSET 10"),
+                         "SELECT COUNT(*) AS total FROM (WITH t AS (SELECT 1) SELECT * FROM t) _cnt")
+
+    def test_inner_limit_is_kept(self):
+        self.assertEqual(_extract_count_query("SELECT * FROM (SELECT 1 LIMIT 5) x"),
+                         "SELECT COUNT(*) AS total FROM (SELECT * FROM (SELECT 1 LIMIT 5) x) _cnt")
+
+    def test_non_select_is_rejected(self):
+        self.assertIsNone(_extract_count_query("DROP TABLE complaints"))
+
+
+class ArrowToRowsTest(unittest.TestCase):
+    def rows(self, sql: str) -> list[dict]:
+        with duckdb.connect() as con:
+            return _arrow_to_rows(con.execute(sql).to_arrow_table())
+
+    def test_dates_and_timestamps_are_iso_strings(self):
+        self.assertEqual(self.rows("""
+            SELECT DATE '2019-11-01' AS d,
+                   date_trunc('month', TIMESTAMP '2019-11-17 10:00:00') AS t,
+                   TIMESTAMP '2019-11-01 03:04:05.12' AS frac,
+                   NULL::TIMESTAMP AS empty
+        """), [{"d": "2019-11-01", "t": "2019-11-01T00:00:00",
+                "frac": "2019-11-01T03:04:05.120000", "empty": None}])
+
+    def test_decimals(self):
+        self.assertEqual(self.rows("""
+            SELECT SUM(x) AS small, 1.50::DECIMAL(4, 2) AS money
+            FROM (VALUES (1), (2)) t(x)
+        """), [{"small": 3, "money": Decimal("1.50")}])
+        huge = self.rows("SELECT SUM(x) AS s FROM (VALUES (9223372036854775807), (10)) t(x)")
+        self.assertEqual(huge, [{"s": 9223372036854775817}])
+        self.assertIs(type(huge[0]["s"]), int)
+
+    def test_intervals_are_timedeltas(self):
+        self.assertEqual(self.rows("SELECT INTERVAL 1 MONTH + INTERVAL 2 DAY AS i"),
+                         [{"i": timedelta(days=32)}])
+
+
+class SemanticCacheTest(unittest.TestCase):
+    def setUp(self):
+        size = 2
+        patches = [
+            mock.patch.object(sql_agent, "SEMANTIC_CACHE_SIZE", size),
+            mock.patch.object(sql_agent, "_semantic_vectors", np.zeros((size, sql_agent.EMBED_DIM), np.float32)),
+            mock.patch.object(sql_agent, "_semantic_entries", []),
+            mock.patch.object(sql_agent, "_semantic_next", 0),
+            mock.patch.object(sql_agent, "_entity_words", lambda: frozenset({"brasov", "cluj"})),
+            # Every question embeds to the same vector: only the literals tell them apart
+            mock.patch.object(sql_agent, "_embed_question", lambda q: self.vec),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.vec = np.eye(sql_agent.EMBED_DIM, dtype=np.float32)[0]
+        self.answers = []
+
+    def ask(self, question: str, response: dict) -> dict:
+        def answer(q):
+            self.answers.append(q)
+            return response
+        with mock.patch.object(sql_agent, "_answer", answer):
+            return sql_agent.chat(question)
+
+    def test_answer_is_reused_for_same_literals(self):
+        self.ask("Reclamații la Brașov în 2023", {"text": "A"})
+        self.assertEqual(self.ask("Reclamatii Brasovului 2023", {"text": "B"}), {"text": "A"})
+        self.assertEqual(len(self.answers), 1)
+
+    def test_different_entity_or_number_is_not_reused(self):
+        self.ask("Reclamații la Brașov în 2023", {"text": "A"})
+        self.assertEqual(self.ask("Reclamații la Cluj în 2023", {"text": "B"}), {"text": "B"})
+        self.assertEqual(self.ask("Reclamații la Brașov în 2024", {"text": "C"}), {"text": "C"})
+
+    def test_errors_are_not_stored(self):
+        self.ask("Reclamații la Brașov", {"text": "429", "error": True})
+        self.assertEqual(sql_agent._semantic_entries, [])
+        self.assertEqual(self.ask("Reclamații la Brașov", {"text": "ok"}), {"text": "ok"})
+
+    def test_oldest_entry_is_overwritten_when_full(self):
+        for question in ("Top 1", "Top 2", "Top 3"):
+            self.ask(question, {"text": question})
+        self.assertEqual([e[1]["text"] for e in sql_agent._semantic_entries], ["Top 3", "Top 2"])
+        self.assertEqual(sql_agent._semantic_next, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
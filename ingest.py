@@ -18,68 +18,104 @@ CSV_FILE = "reclamatii.csv"
 DUCKDB_FILE = "reclamatii.duckdb"
 CHROMA_DIR = "./chroma_db"
 BATCH_SIZE = 100
+CHUNK_ROWS = 50_000  # CSV rows read per step; bounds peak memory
 
 
-def load_and_clean_csv() -> pd.DataFrame:
-    """Load CSV and apply all cleaning transformations."""
-    print("📂 Loading CSV...")
-    df = pd.read_csv(CSV_FILE, encoding="utf-8")
-    print(f"   Loaded {len(df):,} rows")
-
-    # 1. Date Conversion (DD.MM.YYYY -> YYYY-MM-DD)
-    date_columns = ["DATA RECLAMATIE", "DATA FACTURA", "DATA COMANDA"]
-    for col in date_columns:
-        if col in df.columns:
-            df[col] = pd.to_datetime(
-                df[col], 
-                format="%d.%m.%Y", 
-                errors="coerce"
-            )
-            # Convert NaT to None for SQL NULL compatibility
-            df[col] = df[col].where(df[col].notna(), None)
-    print("   ✅ Date columns converted")
+# The cleaned CSV as a query. DuckDB parses the file in parallel and cleans it
+# in the same scan. "#null", "NA" and empty fields all come back as NULL, like
+# pandas' na_values. Dates and numerics are read as text so malformed values
+# become NULL (TRY_*) instead of failing the load.
+CLEANED_CSV_SQL = f"""
+    SELECT * REPLACE (
+        -- 1. Date Conversion (DD.MM.YYYY -> DATE)
+        TRY_STRPTIME("DATA RECLAMATIE", '%d.%m.%Y')::DATE AS "DATA RECLAMATIE",
+        TRY_STRPTIME("DATA FACTURA", '%d.%m.%Y')::DATE AS "DATA FACTURA",
+        TRY_STRPTIME("DATA COMANDA", '%d.%m.%Y')::DATE AS "DATA COMANDA",
+        -- 2. Numeric Cleaning (narrowest type that fits: ids < 2^31, quantities < 2^15)
+        "NR RECLAMATIE"::INTEGER AS "NR RECLAMATIE",
+        COALESCE(TRY_CAST("Valoare Articole Reclamate" AS DOUBLE), 0.0) AS "Valoare Articole Reclamate",
+        COALESCE(TRUNC(TRY_CAST("Cantitate Reclamata" AS DOUBLE)), 0)::SMALLINT AS "Cantitate Reclamata",
+        -- 3. String Cleaning - NULL (incl. #null) becomes empty string
+        COALESCE("OBSERVATII", '') AS "OBSERVATII",
+        COALESCE("DESCRIERE", '') AS "DESCRIERE",
+        COALESCE("MOTIV RECLAMATIE", '') AS "MOTIV RECLAMATIE",
+        COALESCE("ARTICOL DENUMIRE", '') AS "ARTICOL DENUMIRE",
+        COALESCE("RAION", '') AS "RAION",
+        COALESCE("MODALITATE REZOLVARE", '') AS "MODALITATE REZOLVARE",
+        COALESCE("MAGAZIN", '') AS "MAGAZIN",
+        COALESCE("FURNIZOR", '') AS "FURNIZOR"
+    )
+    FROM read_csv_auto('{CSV_FILE}', header=true, sample_size=-1,
+                       nullstr=['#null', '', 'NA'],
+                       types={{'DATA RECLAMATIE': 'VARCHAR', 'DATA FACTURA': 'VARCHAR',
+                              'DATA COMANDA': 'VARCHAR',
+                              'Valoare Articole Reclamate': 'VARCHAR',
+                              'Cantitate Reclamata': 'VARCHAR'}})
+"""
 
-    # 2. Numeric Cleaning
-    if "Valoare Articole Reclamate" in df.columns:
-        df["Valoare Articole Reclamate"] = pd.to_numeric(
-            df["Valoare Articole Reclamate"], 
-            errors="coerce"
-        ).fillna(0.0)
+# What the vector store needs, computed in the scan: DuckDB builds the
+# document text natively, so no per-row Python strings are assembled.
+# `blank` marks rows with no text (a whitespace-only product name counts as none).
+DOCUMENT_SELECT = """
+    "NR RECLAMATIE" AS complaint_id,
+    COALESCE(strftime("DATA RECLAMATIE", '%Y-%m-%d'), '') AS date,
+    "RAION" AS category,
+    'MOTIV: ' || "MOTIV RECLAMATIE" || ' | DESCRIERE: ' || "DESCRIERE"
+        || ' | OBSERVATII: ' || "OBSERVATII" || ' | PRODUS: ' || "ARTICOL DENUMIRE" AS text,
+    ("MOTIV RECLAMATIE" = '' AND "DESCRIERE" = '' AND "OBSERVATII" = ''
+        AND regexp_matches("ARTICOL DENUMIRE", '^\\s*$')) AS blank
+"""
 
-    if "Cantitate Reclamata" in df.columns:
-        df["Cantitate Reclamata"] = pd.to_numeric(
-            df["Cantitate Reclamata"], 
-            errors="coerce"
-        ).fillna(0).astype(int)
-    print("   ✅ Numeric columns cleaned")
 
-    # 3. String Cleaning - fill NaN with empty string
-    text_columns = ["OBSERVATII", "DESCRIERE", "MOTIV RECLAMATIE", "ARTICOL DENUMIRE"]
-    for col in text_columns:
-        if col in df.columns:
-            df[col] = df[col].fillna("").astype(str)
-            # Replace #null with empty string
-            df[col] = df[col].replace("#null", "")
-    print("   ✅ Text columns cleaned")
+# Low-cardinality text columns stored as ENUMs: a small dictionary code per row
+# instead of a string, so filters and GROUP BYs compare integers
+ENUM_TYPES = {
+    "category_t": "RAION",
+    "issue_type_t": "MOTIV RECLAMATIE",
+    "status_t": "MODALITATE REZOLVARE",
+    "shop_t": "MAGAZIN",
+    "supplier_t": "FURNIZOR",
+}
 
-    # 4. Clean other string columns
-    string_columns = ["RAION", "MODALITATE REZOLVARE", "MAGAZIN", "FURNIZOR"]
-    for col in string_columns:
-        if col in df.columns:
-            df[col] = df[col].fillna("").astype(str).replace("#null", "")
 
-    return df
+def iter_clean_csv(select: str, chunk_rows: int = CHUNK_ROWS):
+    """Yield `SELECT select` over the cleaned CSV as DataFrames of about chunk_rows rows."""
+    con = duckdb.connect()
+    # Only the referenced columns are parsed; DuckDB pushes the projection into the scan
+    con.execute(f"SELECT {select} FROM ({CLEANED_CSV_SQL})")
+    offset = 0
+    # fetch_df_chunk streams the result in units of 2048-row vectors
+    while not (chunk := con.fetch_df_chunk(max(1, chunk_rows // 2048))).empty:
+        # Keep row numbers global so document ids stay unique across chunks
+        chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+        offset += len(chunk)
+        yield chunk
+    con.close()
 
 
-def ingest_to_duckdb(df: pd.DataFrame) -> None:
+def ingest_to_duckdb() -> None:
     """Create DuckDB table and insert cleaned data."""
     print("\n🦆 Ingesting to DuckDB...")
     
     # Connect to DuckDB
     con = duckdb.connect(DUCKDB_FILE)
     
-    # Drop and create table
+    # Drop and create table (the ENUM types depend on it)
     con.execute("DROP TABLE IF EXISTS complaints")
+    for type_name in ENUM_TYPES:
+        con.execute(f"DROP TYPE IF EXISTS {type_name}")
+    
+    # Parse and clean the CSV once; the ENUM types and the INSERT below all read
+    # this temp table (a view would re-scan the file for each of them)
+    con.execute(f"CREATE TEMP TABLE cleaned AS {CLEANED_CSV_SQL}")
+    
+    # Sorted values keep ORDER BY on the ENUM columns alphabetical
+    for type_name, column in ENUM_TYPES.items():
+        con.execute(f"""
+            CREATE TYPE {type_name} AS ENUM (
+                SELECT DISTINCT "{column}" FROM cleaned ORDER BY 1
+            )
+        """)
     
     con.execute("""
         CREATE TABLE complaints (
@@ -89,43 +125,50 @@ def ingest_to_duckdb(df: pd.DataFrame) -> None:
             date_order DATE,
             product_name VARCHAR,
             product_code VARCHAR,
-            category VARCHAR,
-            issue_type VARCHAR,
+            category category_t,
+            issue_type issue_type_t,
             description TEXT,
             observations TEXT,
-            status VARCHAR,
+            status status_t,
             value DOUBLE,
-            quantity INTEGER,
-            shop VARCHAR,
-            supplier VARCHAR,
+            quantity SMALLINT,
+            shop shop_t,
+            supplier supplier_t,
             customer_name VARCHAR,
             order_id VARCHAR
         )
     """)
     
-    # Prepare data for insertion
-    insert_df = pd.DataFrame({
-        "id": df["NR RECLAMATIE"],
-        "date_complaint": df["DATA RECLAMATIE"],
-        "date_invoice": df["DATA FACTURA"],
-        "date_order": df["DATA COMANDA"],
-        "product_name": df["ARTICOL DENUMIRE"],
-        "product_code": df.get("ARTICOL COD", ""),
-        "category": df["RAION"],
-        "issue_type": df["MOTIV RECLAMATIE"],
-        "description": df["DESCRIERE"],
-        "observations": df["OBSERVATII"],
-        "status": df["MODALITATE REZOLVARE"],
-        "value": df["Valoare Articole Reclamate"],
-        "quantity": df["Cantitate Reclamata"],
-        "shop": df["MAGAZIN"],
-        "supplier": df["FURNIZOR"],
-        "customer_name": df.get("NUME CLIENT", ""),
-        "order_id": df.get("ID COMANDA", "").astype(str)
-    })
+    con.execute("""
+        INSERT INTO complaints
+        SELECT
+            "NR RECLAMATIE",
+            "DATA RECLAMATIE",
+            "DATA FACTURA",
+            "DATA COMANDA",
+            "ARTICOL DENUMIRE",
+            "ARTICOL COD",
+            "RAION",
+            "MOTIV RECLAMATIE",
+            "DESCRIERE",
+            "OBSERVATII",
+            "MODALITATE REZOLVARE",
+            "Valoare Articole Reclamate",
+            "Cantitate Reclamata",
+            "MAGAZIN",
+            "FURNIZOR",
+            "NUME CLIENT",
+            CAST("ID COMANDA" AS VARCHAR)
+        FROM cleaned
+        -- Sorted by the agent's usual filters so each row group covers a
+        -- narrow date/category range and DuckDB's zone maps can skip the rest
+        ORDER BY "DATA RECLAMATIE", "RAION"
+    """)
+    con.execute("DROP TABLE cleaned")
     
-    # Insert data
-    con.execute("INSERT INTO complaints SELECT * FROM insert_df")
+    # NR RECLAMATIE repeats (one row per complained item), so no PRIMARY KEY;
+    # a plain ART index still turns id lookups into index probes
+    con.execute("CREATE INDEX idx_complaints_id ON complaints (id)")
     
     # Verify
     count = con.execute("SELECT COUNT(*) FROM complaints").fetchone()[0]
@@ -143,7 +186,19 @@ def ingest_to_duckdb(df: pd.DataFrame) -> None:
     con.close()
 
 
-def ingest_to_chroma(df: pd.DataFrame) -> None:
+def prepare_documents(df: pd.DataFrame) -> tuple:
+    """Build texts, metadata and ids for one chunk of DOCUMENT_SELECT rows."""
+    # Skip empty texts
+    kept = df[~df["blank"]]
+    
+    metadatas = kept[["complaint_id", "date", "category"]].to_dict("records")
+    # Use row index to ensure unique IDs
+    ids = ("row_" + kept.index.astype(str) + "_id_" + kept["complaint_id"].astype(str)).tolist()
+    
+    return kept["text"].tolist(), metadatas, ids
+
+
+def ingest_to_chroma() -> None:
     """Create vector embeddings and store in ChromaDB."""
     print("\n🔮 Ingesting to ChromaDB...")
     
@@ -170,64 +225,33 @@ def ingest_to_chroma(df: pd.DataFrame) -> None:
         persist_directory=CHROMA_DIR
     )
     
-    # Prepare documents
-    print("   Preparing documents...")
-    texts = []
-    metadatas = []
-    ids = []
-    
-    for idx, row in df.iterrows():
-        # Create searchable text content
-        text = (
-            f"MOTIV: {row['MOTIV RECLAMATIE']} | "
-            f"DESCRIERE: {row['DESCRIERE']} | "
-            f"OBSERVATII: {row['OBSERVATII']} | "
-            f"PRODUS: {row['ARTICOL DENUMIRE']}"
-        )
-        
-        # Skip empty texts
-        if text.strip() == "MOTIV:  | DESCRIERE:  | OBSERVATII:  | PRODUS: ":
-            continue
-        
-        # Format date for metadata
-        date_val = row["DATA RECLAMATIE"]
-        if pd.notna(date_val):
-            date_str = date_val.strftime("%Y-%m-%d") if hasattr(date_val, 'strftime') else str(date_val)
-        else:
-            date_str = ""
-        
-        texts.append(text)
-        metadatas.append({
-            "complaint_id": int(row["NR RECLAMATIE"]),
-            "date": date_str,
-            "category": str(row["RAION"])
-        })
-        # Use row index to ensure unique IDs
-        ids.append(f"row_{idx}_id_{row['NR RECLAMATIE']}")
-    
-    print(f"   Prepared {len(texts):,} documents for embedding")
-    
-    # Process in batches
-    total_batches = (len(texts) + BATCH_SIZE - 1) // BATCH_SIZE
-    
-    for i in range(0, len(texts), BATCH_SIZE):
-        batch_num = i // BATCH_SIZE + 1
-        batch_texts = texts[i:i + BATCH_SIZE]
-        batch_metadatas = metadatas[i:i + BATCH_SIZE]
-        batch_ids = ids[i:i + BATCH_SIZE]
+    # Stream the document columns one chunk at a time so memory stays bounded
+    batch_num = 0
+    total_docs = 0
+    for chunk in iter_clean_csv(DOCUMENT_SELECT):
+        texts, metadatas, ids = prepare_documents(chunk)
+        total_docs += len(texts)
+        print(f"   Prepared {len(texts):,} documents (rows {chunk.index[0]:,}-{chunk.index[-1]:,})")
         
-        try:
-            vectorstore.add_texts(
-                texts=batch_texts,
-                metadatas=batch_metadatas,
-                ids=batch_ids
-            )
-            print(f"   📦 Batch {batch_num}/{total_batches} complete ({len(batch_texts)} docs)")
-        except Exception as e:
-            print(f"   ⚠️ Batch {batch_num} error: {e}")
-            continue
+        # Process in batches
+        for i in range(0, len(texts), BATCH_SIZE):
+            batch_num += 1
+            batch_texts = texts[i:i + BATCH_SIZE]
+            batch_metadatas = metadatas[i:i + BATCH_SIZE]
+            batch_ids = ids[i:i + BATCH_SIZE]
+            
+            try:
+                vectorstore.add_texts(
+                    texts=batch_texts,
+                    metadatas=batch_metadatas,
+                    ids=batch_ids
+                )
+                print(f"   📦 Batch {batch_num} complete ({len(batch_texts)} docs)")
+            except Exception as e:
+                print(f"   ⚠️ Batch {batch_num} error: {e}")
+                continue
     
-    print(f"   ✅ ChromaDB saved to '{CHROMA_DIR}'")
+    print(f"   ✅ {total_docs:,} documents saved to ChromaDB at '{CHROMA_DIR}'")
 
 
 def main():
@@ -242,14 +266,11 @@ def main():
         print("   Run setup_data.py first!")
         return
     
-    # Load and clean
-    df = load_and_clean_csv()
-    
-    # Ingest to DuckDB
-    ingest_to_duckdb(df)
+    # Ingest to DuckDB (reads the CSV itself)
+    ingest_to_duckdb()
     
-    # Ingest to ChromaDB
-    ingest_to_chroma(df)
+    # Ingest to ChromaDB (streams only the columns the documents need)
+    ingest_to_chroma()
     
     print("\n" + "=" * 50)
     print("✅ INGESTION COMPLETE!")
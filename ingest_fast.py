@@ -4,14 +4,18 @@ With rate limiting to avoid 429 errors
 """
 
 import os
-import shutil
 import time
+import queue
+import asyncio
+import threading
+import hashlib
+import numpy as np
 import pandas as pd
 import duckdb
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 from tqdm import tqdm
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+from google import genai
+from google.genai import types
 import chromadb
 
 # Load environment
@@ -20,50 +24,93 @@ load_dotenv()
 # Configuration
 CSV_FILE = "reclamatii.csv"
 DUCKDB_FILE = "reclamatii.duckdb"
+PARQUET_FILE = "complaints.parquet"  # Portable snapshot; read_parquet loads it without the CSV
 CHROMA_DIR = "./chroma_db"
-BATCH_SIZE = 100
-MAX_WORKERS = 5  # Reduced to avoid rate limiting
-DELAY_BETWEEN_BATCHES = 0.5  # Seconds between batch submissions
-
-
-def load_and_clean_csv() -> pd.DataFrame:
-    """Load CSV and apply all cleaning transformations."""
-    print("📂 Loading CSV...")
-    df = pd.read_csv(CSV_FILE, encoding="utf-8")
-    print(f"   Loaded {len(df):,} rows")
-
-    # 1. Date Conversion
-    date_columns = ["DATA RECLAMATIE", "DATA FACTURA", "DATA COMANDA"]
-    for col in date_columns:
-        if col in df.columns:
-            df[col] = pd.to_datetime(df[col], format="%d.%m.%Y", errors="coerce")
-            df[col] = df[col].where(df[col].notna(), None)
-    print("   ✅ Dates converted")
-
-    # 2. Numeric Cleaning
-    if "Valoare Articole Reclamate" in df.columns:
-        df["Valoare Articole Reclamate"] = pd.to_numeric(
-            df["Valoare Articole Reclamate"], errors="coerce"
-        ).fillna(0.0)
-
-    if "Cantitate Reclamata" in df.columns:
-        df["Cantitate Reclamata"] = pd.to_numeric(
-            df["Cantitate Reclamata"], errors="coerce"
-        ).fillna(0).astype(int)
-    print("   ✅ Numerics cleaned")
-
-    # 3. String Cleaning
-    text_columns = ["OBSERVATII", "DESCRIERE", "MOTIV RECLAMATIE", "ARTICOL DENUMIRE",
-                    "RAION", "MODALITATE REZOLVARE", "MAGAZIN", "FURNIZOR"]
-    for col in text_columns:
-        if col in df.columns:
-            df[col] = df[col].fillna("").astype(str).replace("#null", "")
-    print("   ✅ Text cleaned")
-
-    return df
-
-
-def ingest_to_duckdb(df: pd.DataFrame) -> None:
+EMBED_CACHE_FILE = "embed_cache.duckdb"  # Kept across runs, unlike CHROMA_DIR
+EMBED_CACHE_DTYPE = np.float16  # Half the bytes of float32; cosine scores move < 1e-4
+EMBED_MODEL = "gemini-embedding-001"
+BATCH_SIZE = 100  # Gemini's per-request cap for batch embedding
+MAX_BATCH_CHARS = 80_000  # ~20k tokens at ~4 chars/token; split heavier batches
+MAX_IN_FLIGHT = 32  # Concurrent embedding requests on the event loop
+REQUESTS_PER_MINUTE = 120  # Embedding quota; raise to match your Gemini tier
+RATE_BURST = 10  # Requests allowed back-to-back while the budget is full
+CHUNK_ROWS = 50_000  # CSV rows read per pipeline step; bounds peak memory
+WRITE_BATCH = 1000  # Documents buffered per Chroma upsert (amortizes HNSW inserts)
+
+
+# The cleaned CSV as a query. DuckDB parses the file in parallel and cleans it
+# in the same scan. "#null", "NA" and empty fields all come back as NULL, like
+# pandas' na_values. Dates and numerics are read as text so malformed values
+# become NULL (TRY_*) instead of failing the load.
+CLEANED_CSV_SQL = f"""
+    SELECT * REPLACE (
+        -- 1. Date Conversion (DD.MM.YYYY -> DATE)
+        TRY_STRPTIME("DATA RECLAMATIE", '%d.%m.%Y')::DATE AS "DATA RECLAMATIE",
+        TRY_STRPTIME("DATA FACTURA", '%d.%m.%Y')::DATE AS "DATA FACTURA",
+        TRY_STRPTIME("DATA COMANDA", '%d.%m.%Y')::DATE AS "DATA COMANDA",
+        -- 2. Numeric Cleaning (narrowest type that fits: ids < 2^31, quantities < 2^15)
+        "NR RECLAMATIE"::INTEGER AS "NR RECLAMATIE",
+        COALESCE(TRY_CAST("Valoare Articole Reclamate" AS DOUBLE), 0.0) AS "Valoare Articole Reclamate",
+        COALESCE(TRUNC(TRY_CAST("Cantitate Reclamata" AS DOUBLE)), 0)::SMALLINT AS "Cantitate Reclamata",
+        -- 3. String Cleaning - NULL (incl. #null) becomes empty string
+        COALESCE("OBSERVATII", '') AS "OBSERVATII",
+        COALESCE("DESCRIERE", '') AS "DESCRIERE",
+        COALESCE("MOTIV RECLAMATIE", '') AS "MOTIV RECLAMATIE",
+        COALESCE("ARTICOL DENUMIRE", '') AS "ARTICOL DENUMIRE",
+        COALESCE("RAION", '') AS "RAION",
+        COALESCE("MODALITATE REZOLVARE", '') AS "MODALITATE REZOLVARE",
+        COALESCE("MAGAZIN", '') AS "MAGAZIN",
+        COALESCE("FURNIZOR", '') AS "FURNIZOR"
+    )
+    FROM read_csv_auto('{CSV_FILE}', header=true, sample_size=-1,
+                       nullstr=['#null', '', 'NA'],
+                       types={{'DATA RECLAMATIE': 'VARCHAR', 'DATA FACTURA': 'VARCHAR',
+                              'DATA COMANDA': 'VARCHAR',
+                              'Valoare Articole Reclamate': 'VARCHAR',
+                              'Cantitate Reclamata': 'VARCHAR'}})
+"""
+
+# What the vector store needs, computed in the scan: DuckDB builds the
+# document text natively, so no per-row Python strings are assembled.
+# `blank` marks rows whose four text fields are all empty.
+DOCUMENT_SELECT = """
+    "NR RECLAMATIE" AS id,
+    COALESCE(strftime("DATA RECLAMATIE", '%Y-%m-%d'), '') AS date,
+    "RAION" AS category,
+    'MOTIV: ' || "MOTIV RECLAMATIE" || ' | DESC: ' || "DESCRIERE"
+        || ' | OBS: ' || "OBSERVATII" || ' | PROD: ' || "ARTICOL DENUMIRE" AS text,
+    ("MOTIV RECLAMATIE" = '' AND "DESCRIERE" = '' AND "OBSERVATII" = ''
+        AND "ARTICOL DENUMIRE" = '') AS blank
+"""
+
+
+# Low-cardinality text columns stored as ENUMs: a small dictionary code per row
+# instead of a string, so filters and GROUP BYs compare integers
+ENUM_TYPES = {
+    "category_t": "RAION",
+    "issue_type_t": "MOTIV RECLAMATIE",
+    "status_t": "MODALITATE REZOLVARE",
+    "shop_t": "MAGAZIN",
+    "supplier_t": "FURNIZOR",
+}
+
+
+def iter_clean_csv(select: str, chunk_rows: int = CHUNK_ROWS):
+    """Yield `SELECT select` over the cleaned CSV as DataFrames of about chunk_rows rows."""
+    con = duckdb.connect()
+    # Only the referenced columns are parsed; DuckDB pushes the projection into the scan
+    con.execute(f"SELECT {select} FROM ({CLEANED_CSV_SQL})")
+    offset = 0
+    # fetch_df_chunk streams the result in units of 2048-row vectors
+    while not (chunk := con.fetch_df_chunk(max(1, chunk_rows // 2048))).empty:
+        # Keep row numbers global so document ids stay unique across chunks
+        chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+        offset += len(chunk)
+        yield chunk
+    con.close()
+
+
+def ingest_to_duckdb() -> None:
     """Fast bulk insert to DuckDB."""
     print("\n🦆 Building DuckDB...")
     
@@ -72,106 +119,336 @@ def ingest_to_duckdb(df: pd.DataFrame) -> None:
     
     con = duckdb.connect(DUCKDB_FILE)
     
+    # Parse and clean the CSV once; the ENUM types and the INSERT below all read
+    # this temp table (a view would re-scan the file for each of them)
+    con.execute(f"CREATE TEMP TABLE cleaned AS {CLEANED_CSV_SQL}")
+    
+    # Sorted values keep ORDER BY on the ENUM columns alphabetical
+    for type_name, column in ENUM_TYPES.items():
+        con.execute(f"""
+            CREATE TYPE {type_name} AS ENUM (
+                SELECT DISTINCT "{column}" FROM cleaned ORDER BY 1
+            )
+        """)
+    
     con.execute("""
         CREATE TABLE complaints (
             id INTEGER,
             date_complaint DATE,
             product_name VARCHAR,
-            category VARCHAR,
-            issue_type VARCHAR,
+            category category_t,
+            issue_type issue_type_t,
             description TEXT,
-            status VARCHAR,
+            status status_t,
             value DOUBLE,
-            shop VARCHAR,
-            supplier VARCHAR
+            shop shop_t,
+            supplier supplier_t
         )
     """)
     
-    insert_df = pd.DataFrame({
-        "id": df["NR RECLAMATIE"],
-        "date_complaint": df["DATA RECLAMATIE"],
-        "product_name": df["ARTICOL DENUMIRE"],
-        "category": df["RAION"],
-        "issue_type": df["MOTIV RECLAMATIE"],
-        "description": df["DESCRIERE"],
-        "status": df["MODALITATE REZOLVARE"],
-        "value": df["Valoare Articole Reclamate"],
-        "shop": df["MAGAZIN"],
-        "supplier": df["FURNIZOR"]
-    })
+    con.execute("""
+        INSERT INTO complaints
+        SELECT
+            "NR RECLAMATIE",
+            "DATA RECLAMATIE",
+            "ARTICOL DENUMIRE",
+            "RAION",
+            "MOTIV RECLAMATIE",
+            "DESCRIERE",
+            "MODALITATE REZOLVARE",
+            "Valoare Articole Reclamate",
+            "MAGAZIN",
+            "FURNIZOR"
+        FROM cleaned
+        -- Sorted by the agent's usual filters so each row group covers a
+        -- narrow date/category range and DuckDB's zone maps can skip the rest
+        ORDER BY "DATA RECLAMATIE", "RAION"
+    """)
+    con.execute("DROP TABLE cleaned")
     
-    con.execute("INSERT INTO complaints SELECT * FROM insert_df")
+    # NR RECLAMATIE repeats (one row per complained item), so no PRIMARY KEY;
+    # a plain ART index still turns id lookups into index probes
+    con.execute("CREATE INDEX idx_complaints_id ON complaints (id)")
     
     count = con.execute("SELECT COUNT(*) FROM complaints").fetchone()[0]
     print(f"   ✅ Inserted {count:,} rows")
     
+    # Snapshot to Parquet (ZSTD + dictionary encoding) for cold reloads
+    con.execute(
+        "COPY complaints TO ? (FORMAT PARQUET, COMPRESSION ZSTD, ROW_GROUP_SIZE 122880)",
+        [PARQUET_FILE]
+    )
+    print(f"   💾 Parquet snapshot: {PARQUET_FILE}")
+    
     con.close()
 
 
-def prepare_documents(df: pd.DataFrame) -> tuple:
-    """Prepare all documents for embedding."""
-    texts = []
-    metadatas = []
+def document_ids(texts: list, metadatas: list, seen: dict) -> list:
+    """Content-addressed ids: the same document gets the same id on every run."""
     ids = []
+    for text, meta in zip(texts, metadatas):
+        key = hashlib.blake2b(
+            f"{meta['id']}|{meta['date']}|{meta['category']}\n{text}".encode(), digest_size=12
+        ).hexdigest()
+        # Identical rows (same complaint, same line) get _1, _2, ... in file order
+        n = seen.get(key, 0)
+        seen[key] = n + 1
+        ids.append(f"{key}_{n}" if n else key)
+    return ids
+
+
+def prepare_documents(df: pd.DataFrame, seen: dict) -> tuple:
+    """Prepare all documents for embedding."""
+    kept = df[~df["blank"]]
+    texts = kept["text"].tolist()
+    metadatas = kept[["id", "date", "category"]].to_dict("records")
+    
+    return texts, metadatas, document_ids(texts, metadatas, seen)
+
+
+def text_hash(text: str) -> str:
+    """Content key for the embedding cache (model + text)."""
+    return hashlib.blake2b(f"{EMBED_MODEL}\n{text}".encode(), digest_size=16).hexdigest()
+
+
+def open_embed_cache():
+    """Open (or create) the persistent text-hash -> vector cache."""
+    con = duckdb.connect(EMBED_CACHE_FILE)
+    con.execute("CREATE TABLE IF NOT EXISTS embed_cache (hash VARCHAR PRIMARY KEY, vec BLOB)")
+    return con
+
+
+def add_cached_documents(cache_con, writer, texts, metadatas, ids) -> list:
+    """Queue documents whose vectors are cached; return indices still to embed.
+    Blocking DuckDB reads: call it from a worker thread with its own cursor."""
+    hashes = [text_hash(t) for t in texts]
+    # Look up only this chunk's hashes; the cache grows far beyond one chunk
+    known = {h for (h,) in cache_con.execute(
+        "SELECT hash FROM embed_cache WHERE hash IN (SELECT unnest(?))", [hashes]
+    ).fetchall()}
+    hits = [i for i, h in enumerate(hashes) if h in known]
     
-    for idx, row in df.iterrows():
-        text = (
-            f"MOTIV: {row['MOTIV RECLAMATIE']} | "
-            f"DESC: {row['DESCRIERE']} | "
-            f"OBS: {row['OBSERVATII']} | "
-            f"PROD: {row['ARTICOL DENUMIRE']}"
+    for start in range(0, len(hits), BATCH_SIZE):
+        chunk = hits[start:start + BATCH_SIZE]
+        vecs = dict(cache_con.execute(
+            "SELECT hash, vec FROM embed_cache WHERE hash IN (SELECT unnest(?))",
+            [[hashes[i] for i in chunk]]
+        ).fetchall())
+        writer.put(
+            [np.frombuffer(vecs[hashes[i]], dtype=EMBED_CACHE_DTYPE).astype(np.float32)
+             for i in chunk],
+            [texts[i] for i in chunk],
+            [metadatas[i] for i in chunk],
+            [ids[i] for i in chunk]
         )
-        
-        if text == "MOTIV:  | DESC:  | OBS:  | PROD: ":
-            continue
-        
-        date_val = row["DATA RECLAMATIE"]
-        date_str = date_val.strftime("%Y-%m-%d") if pd.notna(date_val) and hasattr(date_val, 'strftime') else ""
-        
-        texts.append(text)
-        metadatas.append({
-            "id": int(row["NR RECLAMATIE"]),
-            "date": date_str,
-            "category": str(row["RAION"])
-        })
-        ids.append(f"doc_{idx}")
     
-    return texts, metadatas, ids
+    return [i for i, h in enumerate(hashes) if h not in known]
+
+
+def make_batches(texts: list, metadatas: list, ids: list) -> list:
+    """Pack documents into as few requests as the count and size caps allow."""
+    batches = []
+    start = 0
+    chars = 0
+    for i, text in enumerate(texts):
+        if i > start and (i - start == BATCH_SIZE or chars + len(text) > MAX_BATCH_CHARS):
+            batches.append((texts[start:i], metadatas[start:i], ids[start:i], len(batches) + 1))
+            start = i
+            chars = 0
+        chars += len(text)
+    if start < len(texts):
+        batches.append((texts[start:], metadatas[start:], ids[start:], len(batches) + 1))
+    return batches
 
 
-def embed_batch_with_retry(batch_data, embeddings, collection, max_retries=3):
+class RateLimiter:
+    """Async token bucket: bursts up to `burst` requests, then `per_minute` on average."""
+
+    def __init__(self, per_minute: int, burst: int):
+        self.interval = 60.0 / per_minute
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) / self.interval)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                # Sleep only until the next token is due
+                await asyncio.sleep((1 - self.tokens) * self.interval)
+
+
+async def embed_batch(client, batch_data, limiter, max_retries=3):
     """Embed a single batch with retry logic."""
     texts, metadatas, ids, batch_num = batch_data
     
     for attempt in range(max_retries):
         try:
-            # Get embeddings
-            vectors = embeddings.embed_documents(texts)
-            
-            # Add to collection
-            collection.add(
-                embeddings=vectors,
-                documents=texts,
-                metadatas=metadatas,
-                ids=ids
+            # Every attempt, retries included, spends one token of the quota
+            await limiter.acquire()
+            # One batch embedding request for the whole batch
+            result = await client.aio.models.embed_content(
+                model=EMBED_MODEL,
+                contents=texts,
+                config=types.EmbedContentConfig(task_type="RETRIEVAL_DOCUMENT")
             )
-            return {"success": True, "batch": batch_num, "count": len(texts)}
+            vectors = [e.values for e in result.embeddings]
+            return {"success": True, "batch": batch_data, "vectors": vectors}
         
         except Exception as e:
             error_msg = str(e)
             if "429" in error_msg or "RESOURCE_EXHAUSTED" in error_msg:
                 # Rate limited - wait and retry
                 wait_time = (attempt + 1) * 2  # Exponential backoff
-                time.sleep(wait_time)
+                await asyncio.sleep(wait_time)
                 continue
             else:
-                return {"success": False, "batch": batch_num, "error": error_msg[:100]}
+                return {"success": False, "batch": batch_data, "error": error_msg[:100]}
+    
+    return {"success": False, "batch": batch_data, "error": "Max retries exceeded (rate limit)"}
+
+
+class ChromaWriter(threading.Thread):
+    """Single background writer: buffers documents and upserts them in large batches."""
+
+    def __init__(self, collection, cache_con):
+        super().__init__(daemon=True)
+        self.collection = collection
+        self.cache_con = cache_con.cursor()  # DuckDB handles are per thread
+        # Unbounded: the pipeline queue already bounds work in flight, and
+        # a full queue here would block the event loop on put()
+        self.queue = queue.Queue()
+        self.error = None
+
+    def put(self, vectors, texts, metadatas, ids, cache_rows=()):
+        self.queue.put((vectors, texts, metadatas, ids, cache_rows))
+
+    def close(self):
+        """Flush what is buffered and wait for the writer to finish."""
+        self.queue.put(None)
+        self.join()
+        self.cache_con.close()
+        if self.error:
+            raise self.error
+
+    def run(self):
+        buffer = ([], [], [], [], [])
+        while True:
+            item = self.queue.get()
+            if item is not None:
+                for column, values in zip(buffer, item):
+                    column.extend(values)
+            if buffer[3] and (item is None or len(buffer[3]) >= WRITE_BATCH):
+                try:
+                    self.flush(*buffer)
+                except Exception as e:
+                    self.error = e
+                    return
+                buffer = ([], [], [], [], [])
+            if item is None:
+                return
+
+    def flush(self, vectors, texts, metadatas, ids, cache_rows):
+        self.collection.upsert(embeddings=vectors, documents=texts, metadatas=metadatas, ids=ids)
+        if cache_rows:
+            self.cache_con.executemany("INSERT OR IGNORE INTO embed_cache VALUES (?, ?)", cache_rows)
+
+
+def store_batch(result: dict, writer) -> int:
+    """Hand an embedded batch to the writer; return documents stored."""
+    texts, metadatas, ids, _ = result["batch"]
+    vectors = result["vectors"]
+    # Each unique text fans its vector out to every document sharing it
+    repeats = [len(group) for group in ids]
+    writer.put(
+        [v for v, n in zip(vectors, repeats) for _ in range(n)],
+        [t for t, n in zip(texts, repeats) for _ in range(n)],
+        [m for group in metadatas for m in group],
+        [i for group in ids for i in group],
+        cache_rows=[(text_hash(t), np.asarray(v, dtype=EMBED_CACHE_DTYPE).tobytes())
+                    for t, v in zip(texts, vectors)]
+    )
+    return sum(repeats)
+
+
+async def embed_pipeline(client, chunks, collection, cache_con, existing: set) -> dict:
+    """Read, prepare and embed the CSV chunk by chunk on one event loop."""
+    # Bounded queue: the reader pauses while the API side is behind
+    batch_queue = asyncio.Queue(maxsize=MAX_IN_FLIGHT * 2)
+    # Chroma and cache writes run on their own thread, off the event loop
+    writer = ChromaWriter(collection, cache_con)
+    writer.start()
+    limiter = RateLimiter(REQUESTS_PER_MINUTE, RATE_BURST)
+    stats = {"prepared": 0, "unchanged": 0, "cached": 0, "embedded": 0, "errors": 0}
+    seen = {}
+    present = set()
+    cache_reader = cache_con.cursor()  # DuckDB handles are per thread
+    
+    async def produce():
+        # Parsing the next chunk runs in a thread, overlapping in-flight requests
+        while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+            texts, metadatas, ids = prepare_documents(chunk, seen)
+            present.update(ids)
+            stats["prepared"] += len(texts)
+            
+            # A content id already in the collection means the document is unchanged
+            new = [i for i, doc_id in enumerate(ids) if doc_id not in existing]
+            stats["unchanged"] += len(texts) - len(new)
+            texts = [texts[i] for i in new]
+            metadatas = [metadatas[i] for i in new]
+            ids = [ids[i] for i in new]
+            
+            # Reuse vectors from earlier runs; only new or changed texts hit the API
+            missing = await asyncio.to_thread(
+                add_cached_documents, cache_reader, writer, texts, metadatas, ids
+            )
+            stats["cached"] += len(texts) - len(missing)
+            
+            # Identical texts are embedded once; each batch entry carries every
+            # document (metadata + id) that shares the text
+            groups = {}
+            for i in missing:
+                groups.setdefault(texts[i], []).append(i)
+            for batch in make_batches(
+                list(groups),
+                [[metadatas[i] for i in group] for group in groups.values()],
+                [[ids[i] for i in group] for group in groups.values()]
+            ):
+                await batch_queue.put(batch)
+        for _ in range(MAX_IN_FLIGHT):
+            await batch_queue.put(None)
+    
+    async def consume(pbar):
+        while (batch := await batch_queue.get()) is not None:
+            result = await embed_batch(client, batch, limiter)
+            if result["success"]:
+                stats["embedded"] += store_batch(result, writer)
+            else:
+                stats["errors"] += 1
+            pbar.update(1)
+    
+    with tqdm(desc="   Embedding", unit="batch") as pbar:
+        await asyncio.gather(produce(), *(consume(pbar) for _ in range(MAX_IN_FLIGHT)))
+    await asyncio.to_thread(writer.close)
+    cache_reader.close()
+    
+    # Documents the CSV no longer produces (edited or deleted rows) are stale
+    stale = list(existing - present)
+    for start in range(0, len(stale), 5000):
+        collection.delete(ids=stale[start:start + 5000])
+    stats["removed"] = len(stale)
     
-    return {"success": False, "batch": batch_num, "error": "Max retries exceeded (rate limit)"}
+    return stats
 
 
-def ingest_to_chroma_throttled(df: pd.DataFrame) -> None:
-    """Throttled parallel vector embedding."""
+def ingest_to_chroma_throttled() -> None:
+    """Throttled concurrent vector embedding."""
     print("\n🔮 Building ChromaDB (Throttled Parallel)...")
     
     api_key = os.getenv("GOOGLE_API_KEY")
@@ -179,71 +456,30 @@ def ingest_to_chroma_throttled(df: pd.DataFrame) -> None:
         print("   ❌ GOOGLE_API_KEY not found!")
         return
     
-    # Clear existing
-    if os.path.exists(CHROMA_DIR):
-        shutil.rmtree(CHROMA_DIR)
-    
     # Initialize embeddings
-    embeddings = GoogleGenerativeAIEmbeddings(
-        model="models/gemini-embedding-001",
-        google_api_key=api_key
-    )
+    genai_client = genai.Client(api_key=api_key)
     
-    # Initialize Chroma
+    # Initialize Chroma; kept between runs and synced by content id
     client = chromadb.PersistentClient(path=CHROMA_DIR)
     collection = client.get_or_create_collection(
         name="complaints",
         metadata={"hnsw:space": "cosine"}
     )
+    existing = set(collection.get(include=[])["ids"])
     
-    # Prepare documents
-    print("   Preparing documents...")
-    texts, metadatas, ids = prepare_documents(df)
-    print(f"   Prepared {len(texts):,} documents")
-    
-    # Create batches
-    batches = []
-    for i in range(0, len(texts), BATCH_SIZE):
-        batch_num = i // BATCH_SIZE + 1
-        batches.append((
-            texts[i:i + BATCH_SIZE],
-            metadatas[i:i + BATCH_SIZE],
-            ids[i:i + BATCH_SIZE],
-            batch_num
-        ))
-    
-    total_batches = len(batches)
-    print(f"   {total_batches} batches | {MAX_WORKERS} workers | {DELAY_BETWEEN_BATCHES}s delay")
-    
-    # Process with throttling
-    success_count = 0
-    error_count = 0
-    
-    with tqdm(total=total_batches, desc="   Embedding", unit="batch") as pbar:
-        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            futures = []
-            
-            for batch in batches:
-                future = executor.submit(
-                    embed_batch_with_retry, 
-                    batch, 
-                    embeddings, 
-                    collection
-                )
-                futures.append(future)
-                time.sleep(DELAY_BETWEEN_BATCHES)  # Throttle submissions
-            
-            for future in as_completed(futures):
-                result = future.result()
-                if result["success"]:
-                    success_count += result["count"]
-                else:
-                    error_count += 1
-                pbar.update(1)
+    # Stream the document columns: memory stays at one chunk, and embedding
+    # requests run while the next chunk is parsed
+    print(f"   {CHUNK_ROWS:,}-row chunks | {MAX_IN_FLIGHT} in flight | {REQUESTS_PER_MINUTE} req/min")
+    cache_con = open_embed_cache()
+    chunks = iter_clean_csv(DOCUMENT_SELECT)
+    stats = asyncio.run(embed_pipeline(genai_client, chunks, collection, cache_con, existing))
+    cache_con.close()
     
-    print(f"\n   ✅ Embedded {success_count:,} documents")
-    if error_count > 0:
-        print(f"   ⚠️ {error_count} batches had errors")
+    print(f"\n   ✅ Embedded {stats['embedded']:,} of {stats['prepared']:,} documents "
+          f"({stats['unchanged']:,} unchanged, {stats['cached']:,} cached, "
+          f"{stats['removed']:,} stale removed)")
+    if stats["errors"] > 0:
+        print(f"   ⚠️ {stats['errors']} batches had errors")
     
     print(f"   💾 Saved to '{CHROMA_DIR}'")
 
@@ -257,14 +493,13 @@ def main():
         print(f"❌ CSV not found: {CSV_FILE}")
         return
     
-    df = load_and_clean_csv()
-    ingest_to_duckdb(df)
-    ingest_to_chroma_throttled(df)
+    ingest_to_duckdb()
+    ingest_to_chroma_throttled()
     
     print("\n" + "=" * 60)
     print("✅ COMPLETE!")
     print("=" * 60)
-    print(f"\n📊 DuckDB: {DUCKDB_FILE}")
+    print(f"\n📊 DuckDB: {DUCKDB_FILE} (+ {PARQUET_FILE})")
     print(f"🔮 ChromaDB: {CHROMA_DIR}")
 
 